@@ -1,7 +1,8 @@
+import itertools
 import numpy as np
 import ursina as ua
 
-from isosurface import surface_from_cube
+from isosurface import surfaces_from_cubes
 # from cool_normals_shader import cool_normals
 
 
@@ -28,14 +29,12 @@ def update():
     max_indicator = max_indicator[:-1, :, :] | max_indicator[1:, :, :]
     indicator = min_indicator ^ max_indicator
 
-    tris = []
-    for ix, iy, iz in zip(*np.where(indicator)):
-
-        coordinates = np.stack(list(ii[ix:ix + 2, iy:iy + 2, iz:iz + 2] for ii in (xx, yy, zz)), axis=-1)
-        coordinates = coordinates.reshape((-1, 3))
-        values_at_coords = potentials[ix:ix+2, iy:iy+2, iz:iz+2].reshape((-1,))
-        swizzle = [1, 5, 7, 3, 2, 6, 4, 0]
-        tris.extend(surface_from_cube(coordinates[swizzle], values_at_coords[swizzle], threshold))
+    # gather the corners of all active cubes at once, in the order surface_from_cube expects them
+    swizzle = [1, 5, 7, 3, 2, 6, 4, 0]
+    corners = np.array(list(itertools.product([0, 1], repeat=3)))[swizzle]  # offsets into the 2x2x2 block
+    ix, iy, iz = (index[:, None] + offset for index, offset in zip(np.nonzero(indicator), corners.T))
+    coordinates = np.stack((xx[ix, iy, iz], yy[ix, iy, iz], zz[ix, iy, iz]), axis=-1)
+    tris = surfaces_from_cubes(coordinates, potentials[ix, iy, iz], threshold)
 
     # normals = ...
 
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from isosurface import surface_from_cube, surfaces_from_cubes
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_surfaces_from_cubes_matches_surface_from_cube(seed):
+    """
+    surface_from_cube is the reference: the batched engine must return exactly the same triangles on random fields.
+    """
+    rng = np.random.default_rng(seed)
+    n_cubes, levels = rng.integers(1, 50), rng.integers(2, 6)  # few levels: values often equal the threshold
+    potentials = rng.integers(0, levels, (n_cubes, 8)) * rng.uniform(0.1, 10)
+    threshold = rng.choice(potentials.ravel()) if seed % 2 else rng.uniform(potentials.min(), potentials.max())
+    vertices = rng.normal(size=(n_cubes, 8) + ((3,), (3, 2))[seed % 3 == 0])  # coordinates, and with normals
+
+    expected = [triangle for cube_vertices, cube_potentials in zip(vertices, potentials)
+                for triangle in surface_from_cube(cube_vertices, cube_potentials, threshold)]
+    batched = surfaces_from_cubes(vertices, potentials, threshold)
+    assert len(batched) == len(expected), f'seed {seed}: {len(batched)} vertices instead of {len(expected)}'
+    assert all(map(np.array_equal, batched, expected)), f'seed {seed}: vertices differ'
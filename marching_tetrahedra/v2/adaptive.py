@@ -0,0 +1,80 @@
+import numpy as np
+
+from bricks import brick_reduce, cube_configurations
+from isosurface2 import cube_tetras, cube_vertices, extract_cubes, grid_to_world, sample_ranges
+from narrow_band import SparseVolume, extract_narrow_band
+
+
+def tetra_interpolate(corner_values, points):
+    """
+    Piecewise linear interpolation of the values at the corners of cubes, over their tetrahedra.
+    corner_values is (N, 8), in cube_vertices order, and points (N, 3) are local coordinates in [0, 1].
+    This is the field that marching tetrahedra actually sees inside a cube.
+    """
+    tetras = cube_vertices[cube_tetras]  # (6, 4, 3)
+    inverses = np.linalg.inv(np.transpose(tetras[:, 1:] - tetras[:, :1], (0, 2, 1)))
+    weights = np.einsum('tij,ntj->nti', inverses, points[:, None, :] - tetras[None, :, 0])
+    weights = np.concatenate((1 - weights.sum(axis=-1, keepdims=True), weights), axis=-1)  # (N, 6, 4)
+
+    containing = np.argmax(weights.min(axis=-1), axis=1)  # on shared faces, any of the tetras will do
+    rows = np.arange(len(points))
+    return np.sum(weights[rows, containing] * corner_values[rows[:, None], np.array(cube_tetras)[containing]], axis=-1)
+
+
+def render_adaptive(volume, interval, sample_fun, threshold, packed_lut, tolerance, stride=4, weld=False):
+    """
+    Adaptive marching tetrahedra: cells of stride^3 cubes where the field is close to linear are extracted as a
+    single coarse cube, the others at full resolution. A cell is refined when, at its center, sample_fun differs by
+    more than tolerance from the coarse interpolation.
+    Transitions are crack-free: samples of refined cells lying on the boundary of a coarse one take the value
+    of the coarse interpolation there. Since the fine tetrahedra refine the coarse ones on the shared faces, both
+    sides see the same field, and their contours meet, with T-junctions.
+    Returns float32 vertices and uint32 flattened triangles, like render_vectorized.
+    """
+    x_range, y_range, z_range = sample_ranges(volume, interval)
+    shape = (len(y_range), len(x_range), len(z_range))
+    origin = np.array((x_range[0], y_range[0], z_range[0]))
+    coarse = [np.minimum(np.arange(-(-(n - 1) // stride) + 1) * stride, n - 1) for n in shape]
+
+    yy, xx, zz = np.meshgrid(y_range[coarse[0]], x_range[coarse[1]], z_range[coarse[2]], indexing='ij')
+    potentials = sample_fun(xx, yy, zz)
+    cells = np.stack(np.nonzero(np.logical_and(brick_reduce(potentials, 1, np.minimum) <= threshold,
+                                               threshold < brick_reduce(potentials, 1, np.maximum))), axis=-1)
+
+    # refine the cells that are not full size, and those where the field is far from linear
+    corner_values = np.stack([potentials[tuple((cells + corner).T)] for corner in cube_vertices], axis=-1)
+    cy, cx, cz = (origin[[1, 0, 2]] + interval * stride * (cells + 0.5)).T
+    error = np.abs(sample_fun(cx, cy, cz) - tetra_interpolate(corner_values, np.full((len(cells), 3), 0.5)))
+    is_partial = np.any([np.diff(indexes)[cells[:, axis]] < stride for axis, indexes in enumerate(coarse)], axis=0)
+    is_refined = np.zeros([len(indexes) - 1 for indexes in coarse], dtype=bool)
+    is_refined[tuple(cells[np.logical_or(error > tolerance, is_partial)].T)] = True
+    refined = np.stack(np.nonzero(is_refined), axis=-1)
+
+    # coarse cells are extracted on the coarse grid, and scaled to the full resolution one
+    coarse_cells = cells[~is_refined[tuple(cells.T)]]
+    configurations = cube_configurations(potentials, threshold, coarse_cells)
+    is_active = np.logical_and(0 < configurations, configurations < 255)
+    verts, tris = extract_cubes(potentials, threshold, packed_lut, coarse_cells[is_active], configurations[is_active], weld)
+    coarse_mesh = verts * stride, tris
+
+    # samples of refined cells, where those on the boundary of any coarse cell are interpolated instead
+    local = np.stack(np.meshgrid(*[np.arange(stride + 1)] * 3, indexing='ij'), axis=-1).reshape((-1, 3))
+    samples = np.minimum((stride * refined[:, None, :] + local).reshape((-1, 3)), np.array(shape) - 1)
+    samples = np.unique(np.ravel_multi_index(tuple(samples.T), shape))
+    points = np.stack(np.unravel_index(samples, shape), axis=-1)
+    values = sample_fun(x_range[points[:, 1]], y_range[points[:, 0]], z_range[points[:, 2]])
+
+    last_cell = np.array(is_refined.shape) - 1
+    for low_or_high in cube_vertices:  # the up to 8 cells sharing a sample on their boundary
+        neighbours = np.clip((points - low_or_high) // stride, 0, last_cell)
+        is_snapped = ~is_refined[tuple(neighbours.T)]
+        neighbours, local_points = neighbours[is_snapped], (points[is_snapped] - stride * neighbours[is_snapped]) / stride
+        corner_values = np.stack([potentials[tuple((neighbours + corner).T)] for corner in cube_vertices], axis=-1)
+        values[is_snapped] = tetra_interpolate(corner_values, local_points)
+
+    fine_potentials = SparseVolume(shape, stride, refined, samples, values)
+    verts, tris = extract_narrow_band(fine_potentials, threshold, packed_lut, weld)
+
+    verts = np.concatenate((coarse_mesh[0], verts))
+    tris = np.concatenate((coarse_mesh[1], tris + np.uint32(len(coarse_mesh[0]))))
+    return grid_to_world(verts, origin, interval).astype(np.float32), tris
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class MeshWorker:
+    """
+    Producer/consumer mesh generation: make_mesh runs on a worker while the previous mesh is displayed.
+    Call poll once per frame: it returns the mesh finished since the previous call, or None if the worker is still
+    busy, in which case the displayed mesh stays as it is, and the frame is not held up by extraction.
+    As soon as a mesh is taken, the next one is started with the arguments of that poll, e.g. the current time.
+    A ProcessPoolExecutor also works, as long as make_mesh can be pickled, and keeps no state across calls.
+    """
+
+    def __init__(self, make_mesh, executor=None):
+        self.make_mesh = make_mesh
+        self.executor = executor or ThreadPoolExecutor(1)
+        self.pending = None
+
+    def poll(self, *args):
+        mesh = None
+        if self.pending is not None and self.pending.done():
+            mesh, self.pending = self.pending.result(), None  # raises whatever make_mesh raised
+        if self.pending is None:
+            self.pending = self.executor.submit(self.make_mesh, *args)
+        return mesh
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class DoubleBuffer:
+    """
+    Two growable float32 arrays used in turn: the one being filled by the worker is never the one displayed.
+    Only valid if at most one mesh is in flight, like with MeshWorker, and the displayed mesh was replaced
+    before the next but one is made.
+    """
+
+    def __init__(self, columns=3):
+        self.buffers, self.front = [np.zeros((0, columns), dtype=np.float32)] * 2, 0
+        self.columns = columns
+
+    def back(self, rows):
+        """
+        Returns the first rows of the buffer not displayed, growing it if needed, and makes it the front one.
+        """
+        self.front = 1 - self.front
+        if len(self.buffers[self.front]) < rows:
+            self.buffers[self.front] = np.empty((max(rows, 2 * len(self.buffers[self.front])), self.columns), dtype=np.float32)
+        return self.buffers[self.front][:rows]
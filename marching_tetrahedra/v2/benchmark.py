@@ -0,0 +1,235 @@
+"""
+Headless benchmark of the extraction engines, over a range of grid sizes and fields.
+Each case runs in a fresh process, so that its peak RSS is its own. Results are printed, and saved as JSON:
+
+    python benchmark.py --sizes 32 64 128 --fields gaussians gyroid --output results.json
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_module(name, path):
+    """
+    Import a module from a file, v1 and v3 live next to v2 without being packages.
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(here, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def gaussians(xx, yy, zz):  # the field of the viewers
+
+    def gaussian_3d(mu, gamma):
+        xmmu2 = (xx - mu[0]) ** 2 + (yy - mu[1]) ** 2 + (zz - mu[2]) ** 2
+        return np.exp(-xmmu2 / (2 * gamma ** 2)) / gamma * (2 * np.pi) ** 0.5
+
+    return gaussian_3d([-0.5, 0, 0], 0.4) + gaussian_3d([-0.2, 0.7, 0], 0.2) + gaussian_3d([0.5, 0, 0], 0.3)
+
+
+def sphere(xx, yy, zz):  # a single smooth surface, few active cells
+    return xx ** 2 + yy ** 2 + zz ** 2
+
+
+def gyroid(xx, yy, zz):  # a triply periodic surface, many active cells
+    xx, yy, zz = 2 * np.pi * xx, 2 * np.pi * yy, 2 * np.pi * zz
+    return np.sin(xx) * np.cos(yy) + np.sin(yy) * np.cos(zz) + np.sin(zz) * np.cos(xx)
+
+
+fields = {'gaussians': (gaussians, 6), 'sphere': (sphere, 0.5), 'gyroid': (gyroid, 0)}
+
+
+def v1_cubes(volume, interval, sample_fun, threshold, surface_from_cube, surfaces_from_cubes=None):
+    """
+    The per-cube loop of the v1 viewer, over surface_from_cube, or the batched gather and surfaces_from_cubes
+    that replaced it, if given.
+    """
+    xx, yy, zz = np.meshgrid(*[np.arange(volume[dim][0], volume[dim][1] + interval, interval) for dim in range(3)])
+    potentials = sample_fun(xx, yy, zz)
+
+    indicator = potentials < threshold
+    min_indicator = indicator[:, :, :-1] & indicator[:, :, 1:]
+    min_indicator = min_indicator[:, :-1, :] & min_indicator[:, 1:, :]
+    min_indicator = min_indicator[:-1, :, :] & min_indicator[1:, :, :]
+    max_indicator = indicator[:, :, :-1] | indicator[:, :, 1:]
+    max_indicator = max_indicator[:, :-1, :] | max_indicator[:, 1:, :]
+    max_indicator = max_indicator[:-1, :, :] | max_indicator[1:, :, :]
+    indicator = min_indicator ^ max_indicator
+
+    if surfaces_from_cubes is not None:
+        corners = np.array(list(itertools.product([0, 1], repeat=3)))[[1, 5, 7, 3, 2, 6, 4, 0]]
+        ix, iy, iz = (index[:, None] + offset for index, offset in zip(np.nonzero(indicator), corners.T))
+        coordinates = np.stack((xx[ix, iy, iz], yy[ix, iy, iz], zz[ix, iy, iz]), axis=-1)
+        return len(surfaces_from_cubes(coordinates, potentials[ix, iy, iz], threshold)) // 3
+
+    tris = []
+    for ix, iy, iz in zip(*np.where(indicator)):
+        coordinates = np.stack(list(ii[ix:ix + 2, iy:iy + 2, iz:iz + 2] for ii in (xx, yy, zz)), axis=-1)
+        coordinates = coordinates.reshape((-1, 3))
+        values_at_coords = potentials[ix:ix + 2, iy:iy + 2, iz:iz + 2].reshape((-1,))
+        swizzle = [1, 5, 7, 3, 2, 6, 4, 0]
+        tris.extend(surface_from_cube(coordinates[swizzle], values_at_coords[swizzle], threshold))
+    return len(tris) // 3
+
+
+def engines():
+    """
+    Each engine runs the whole pipeline, from sampling to the mesh, and returns its triangle count.
+    Modules and lookup tables are loaded here, once, out of the timings.
+    """
+    import isosurface2
+    from bricks import build_minmax, extract_sparse
+    from narrow_band import render_narrow_band
+    from workspace import Workspace
+
+    isosurface_v1 = load_module('isosurface_v1', '../v1/isosurface.py')
+    isosurface3 = load_module('isosurface3', '../v3/isosurface3.py')
+    face_lut, packed_lut = isosurface2.precompute_surface_from_cube(), isosurface2.load_face_lut()
+    packed_lut_v3 = isosurface3.pack_face_lut(isosurface3.precompute_surface_from_cube())
+
+    def bricks(volume, interval, sample_fun, threshold):
+        potentials, _ = isosurface2.sample_volume(volume, interval, sample_fun, sparse=True)
+        return len(extract_sparse(potentials, threshold, packed_lut, build_minmax(potentials))[1]) // 3
+
+    capacities = {}
+
+    def jax(volume, interval, sample_fun, threshold):
+        from isosurface_jax import render_jax
+        if sample_fun not in capacities:  # fixed buffers cost in proportion to their size, fit them to the surface
+            lut_indexes = isosurface2.lookup_indexes(isosurface2.sample_volume(volume, interval, sample_fun)[0], threshold)
+            active = np.count_nonzero((0 < lut_indexes) & (lut_indexes < 255))
+            capacities[sample_fun] = 2 ** int(np.ceil(np.log2(max(active, 1))))
+        return len(render_jax(volume, interval, sample_fun, threshold, packed_lut, max_cubes=capacities[sample_fun])[1]) // 3
+
+    workspaces = {}
+
+    def workspace(volume, interval, sample_fun, threshold):
+        potentials, origin = isosurface2.sample_volume(volume, interval, sample_fun, sparse=True)
+        if potentials.shape not in workspaces:  # kept across repeats, like across the frames of an animation
+            workspaces[potentials.shape] = Workspace(potentials.shape, packed_lut, potentials.dtype)
+        return len(workspaces[potentials.shape].extract(potentials, threshold, origin, interval)[1]) // 3
+
+    def streaming(volume, interval, sample_fun, threshold):
+        chunks = isosurface3.render(volume, interval, sample_fun, threshold, packed_lut_v3)
+        return sum(len(tris) for _, tris in chunks) // 3
+
+    return {
+        'v1_cubes': lambda *args: v1_cubes(*args, isosurface_v1.surface_from_cube),
+        'v1_batched': lambda *args: v1_cubes(*args, isosurface_v1.surface_from_cube, isosurface_v1.surfaces_from_cubes),
+        'v2_render': lambda *args: len(isosurface2.render(*args, face_lut, sparse=True)[1]) // 3,
+        'v2_vectorized': lambda *args: len(isosurface2.render_vectorized(*args, packed_lut, sparse=True)[1]) // 3,
+        'v2_welded': lambda *args: len(isosurface2.render_vectorized(*args, packed_lut, weld=True, sparse=True)[1]) // 3,
+        'v2_parallel': lambda *args: len(isosurface2.render_parallel(*args, packed_lut, sparse=True)[1]) // 3,
+        'v2_bricks': bricks,
+        'v2_narrow_band': lambda *args: len(render_narrow_band(*args, packed_lut, weld=True)[1]) // 3,
+        'v2_jax': jax,
+        'v2_workspace': workspace,
+        'v3_streaming': streaming,
+    }
+
+
+engine_names = ['v1_cubes', 'v1_batched', 'v2_render', 'v2_vectorized', 'v2_welded', 'v2_parallel', 'v2_bricks', 'v2_narrow_band',
+                'v2_jax', 'v2_workspace', 'v3_streaming']
+max_cells = {'v1_cubes': 48 ** 3, 'v2_render': 96 ** 3}  # the per-cube python loops, beyond that they take minutes
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kilobytes on linux
+
+
+def run_case(name, field, size, repeat):
+    """
+    Time one engine on one field, over a grid of size samples per side of [-1, 1]^3. The first call is timed apart,
+    since it includes imports, loading the LUTs and, for jax, compilation. Runs in its own process.
+    """
+    sys.path.insert(0, here)
+    sample_fun, threshold = fields[field]
+    volume, interval = ((-1, 1),) * 3, 2 / (size - 1)
+    cells = np.prod([len(np.arange(-1, 1 + interval, interval)) - 1 for _ in range(3)])
+    base_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    run = engines()[name]
+    triangles = run(volume, interval, sample_fun, threshold)
+    first_seconds = time.perf_counter() - start
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(volume, interval, sample_fun, threshold)
+        seconds.append(time.perf_counter() - start)
+    best = min(seconds) if seconds else first_seconds
+    return {'engine': name, 'field': field, 'size': size, 'cells': int(cells), 'triangles': int(triangles),
+            'first_seconds': first_seconds, 'seconds': best, 'cells_per_s': cells / best,
+            'triangles_per_s': triangles / best, 'base_rss_mb': base_rss, 'peak_rss_mb': peak_rss_mb()}
+
+
+def lut_build_times():
+    """
+    Seconds to build the lookup tables: v2 from scratch, packed, and loaded from the on-disk cache.
+    """
+    sys.path.insert(0, here)
+    import isosurface2
+
+    start = time.perf_counter()
+    face_lut = isosurface2.precompute_surface_from_cube()
+    built = time.perf_counter()
+    isosurface2.pack_face_lut(face_lut)
+    packed = time.perf_counter()
+    isosurface2.load_face_lut()
+    loaded = time.perf_counter()
+    return {'precompute_seconds': built - start, 'pack_seconds': packed - built, 'load_cached_seconds': loaded - packed}
+
+
+def in_subprocess(fun, *args):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(fun, *args).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=engine_names, choices=engine_names)
+    parser.add_argument('--fields', nargs='+', default=list(fields), choices=list(fields))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[16, 32, 64, 128])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    report = {'machine': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                          'processor': platform.processor(), 'cpu_count': os.cpu_count()},
+              'lut': in_subprocess(lut_build_times), 'results': []}
+    print(' '.join(f'{key} {value:.3f}s' for key, value in report['lut'].items()))
+
+    for field in args.fields:
+        for size in args.sizes:
+            for name in args.engines:
+                if (size - 1) ** 3 > max_cells.get(name, np.inf):
+                    continue
+                try:
+                    result = in_subprocess(run_case, name, field, size, args.repeat)
+                except Exception as error:  # e.g. jax not installed, report it and go on
+                    print(f'{field:>10} {size:>4} {name:>15}  failed: {error!r}')
+                    continue
+                report['results'].append(result)
+                print(f'{field:>10} {size:>4} {name:>15}  {result["seconds"]:8.4f}s '
+                      f'{result["cells_per_s"]:12.0f} cells/s {result["triangles_per_s"]:12.0f} tris/s '
+                      f'{result["peak_rss_mb"]:8.1f} MB')
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
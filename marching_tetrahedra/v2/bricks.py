@@ -0,0 +1,166 @@
+import numpy as np
+
+from isosurface2 import cube_vertices, extract_cubes, stitch
+from profiling import no_profile
+
+
+def brick_reduce(values, brick, ufunc):
+    """
+    Reduce values with ufunc (e.g. np.minimum) over bricks of brick^3 cubes. Neighbouring bricks share
+    their boundary samples, so that each brick sees all the corners of its cubes.
+    """
+    for axis in range(3):
+        starts = np.arange(0, values.shape[axis] - 1, brick)
+        reduced = values.take(starts, axis=axis)
+        for step in range(1, brick + 1):  # a few large strided reductions are faster than reduceat
+            reduced = ufunc(reduced, values.take(np.minimum(starts + step, values.shape[axis] - 1), axis=axis))
+        values = reduced
+    return values
+
+
+def brick_samples(is_brick, brick, shape):
+    """
+    The samples of a grid of the given shape whose bricks, as in brick_reduce, are all True: shared boundary samples
+    need both neighbouring bricks.
+    """
+    for axis, size in enumerate(shape):
+        samples, count = np.arange(size), is_brick.shape[axis]
+        is_brick = np.logical_and(is_brick.take(np.clip((samples - 1) // brick, 0, count - 1), axis=axis),
+                                  is_brick.take(np.minimum(samples // brick, count - 1), axis=axis))
+    return is_brick
+
+
+def build_minmax(potentials, brick=8):
+    """
+    Returns a min/max hierarchy over the potentials, as (brick, levels).
+    levels[0] holds the (mins, maxs) of each brick of brick^3 cubes, and each following level those of
+    2x2x2 nodes of the previous one, up to a single root node.
+    It does not depend on the threshold, and can be reused to extract any number of surfaces.
+    """
+    levels = [(brick_reduce(potentials, brick, np.minimum), brick_reduce(potentials, brick, np.maximum))]
+    while max(levels[-1][0].shape) > 1:
+        mins, maxs = levels[-1]
+        for axis in range(3):
+            starts = np.arange(0, mins.shape[axis], 2)
+            mins, maxs = np.minimum.reduceat(mins, starts, axis=axis), np.maximum.reduceat(maxs, starts, axis=axis)
+        levels.append((mins, maxs))
+    return brick, levels
+
+
+def active_bricks(hierarchy, threshold):
+    """
+    Returns the (N, 3) indexes of the bricks whose [min, max] range straddles the threshold.
+    Only the children of active nodes are visited, from the root down.
+    """
+    _, levels = hierarchy
+    nodes = np.zeros((1, 3), dtype=int)
+    for level, (mins, maxs) in reversed(list(enumerate(levels))):
+        if level < len(levels) - 1:  # expand each active node of the level above into its (up to) 8 children
+            nodes = (2 * nodes[:, None, :] + cube_vertices).reshape((-1, 3))
+            nodes = nodes[np.all(nodes < mins.shape, axis=1)]
+        index = tuple(nodes.T)
+        nodes = nodes[np.logical_and(mins[index] <= threshold, threshold < maxs[index])]
+    return nodes
+
+
+def brick_cubes(bricks, brick, shape):
+    """
+    Returns the (N, 3) indexes of the cubes inside the given bricks, brick by brick, for potentials of the given shape.
+    """
+    local = np.stack(np.meshgrid(*[np.arange(brick)] * 3, indexing='ij'), axis=-1).reshape((-1, 3))
+    cubes = (brick * bricks[:, None, :] + local).reshape((-1, 3))
+    return cubes[np.all(cubes < np.array(shape) - 1, axis=1)]
+
+
+def cube_configurations(potentials, threshold, cubes):
+    """
+    Returns the index into the lookup table of each of the given cubes.
+    """
+    configurations = np.zeros(len(cubes), dtype=np.uint8)
+    for index, corner in enumerate(cube_vertices):
+        configurations |= (potentials[tuple((cubes + corner).T)] > threshold).view(np.uint8) << index
+    return configurations
+
+
+def extract_sparse(potentials, threshold, packed_lut, hierarchy, weld=False):
+    """
+    Same as isosurface2.extract, but only the cubes of the bricks straddling the threshold are visited.
+    """
+    brick, _ = hierarchy
+    cubes = brick_cubes(active_bricks(hierarchy, threshold), brick, potentials.shape)
+    configurations = cube_configurations(potentials, threshold, cubes)
+    is_active = np.logical_and(0 < configurations, configurations < 255)
+
+    return extract_cubes(potentials, threshold, packed_lut, cubes[is_active], configurations[is_active], weld)
+
+
+class IncrementalSurface:
+    """
+    Welded surface of a field that changes over time, re-extracted only where it changed.
+    The mesh is kept brick by brick: on each update, the triangles of the dirty bricks are dropped, those bricks are
+    extracted again, and the result is stitched to the rest of the previous mesh by edge keys.
+    Untouched bricks are neither indexed nor interpolated again.
+    """
+
+    def __init__(self, packed_lut, brick=8):
+        self.packed_lut, self.brick = packed_lut, brick
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the mesh: the next update extracts everything.
+        """
+        self.potentials = self.threshold = self.was_active = None
+        self.verts, self.tris, self.keys = np.zeros((0, 3)), np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64)
+        self.triangle_bricks = np.zeros(0, dtype=int)  # linear index of the brick each triangle comes from
+
+    def update(self, potentials, threshold, dirty=None, atol=0, profile=no_profile):
+        """
+        Returns the welded surface of potentials, in grid index space like isosurface2.extract.
+        The dirty region, a tuple of slices into potentials, is where values changed since the previous call.
+        If None, it is found by comparing with the potentials the current mesh was extracted from, ignoring changes up
+        to atol: slower changes add up until they are noticed.
+        Only the dirty bricks straddling the threshold, now or before, are extracted again.
+        Stages are timed by profile, see isosurface2.render: the caller starts it, e.g. before sampling.
+        """
+        brick = self.brick
+        is_active = np.logical_and(brick_reduce(potentials, brick, np.minimum) <= threshold,
+                                   threshold < brick_reduce(potentials, brick, np.maximum))
+
+        if self.potentials is None or self.potentials.shape != potentials.shape or self.threshold != threshold:
+            self.reset()  # the previous mesh may come from another grid of bricks
+            is_dirty = np.ones_like(is_active)
+            self.potentials, self.was_active = potentials.copy(), is_active
+        else:
+            if dirty is None:
+                changed = np.abs(potentials - self.potentials) > atol
+            else:
+                changed = np.zeros(potentials.shape, dtype=bool)
+                changed[dirty] = True
+            is_dirty = brick_reduce(changed, brick, np.logical_or) & (is_active | self.was_active)
+
+        # drop the triangles of dirty bricks, and the vertices they no longer use
+        kept = ~is_dirty.reshape(-1)[self.triangle_bricks]
+        used, kept_tris = np.unique(self.tris.reshape((-1, 3))[kept], return_inverse=True)
+        kept_piece = self.verts[used], kept_tris.reshape(-1).astype(np.uint32), self.keys[used]
+        profile.lap('dirty bricks', is_active, is_dirty, *kept_piece)
+
+        # extract the dirty bricks again, keeping track of the brick each triangle comes from
+        bricks = np.stack(np.nonzero(is_dirty & is_active), axis=-1)
+        cubes = brick_cubes(bricks, brick, potentials.shape)
+        configurations = cube_configurations(potentials, threshold, cubes)
+        is_cube_active = np.logical_and(0 < configurations, configurations < 255)
+        cubes, configurations = cubes[is_cube_active], configurations[is_cube_active]
+        profile.lap('active cells', cubes, configurations)
+        new_piece = extract_cubes(potentials, threshold, self.packed_lut, cubes, configurations, weld=True, return_keys=True,
+                                  profile=profile)
+        cube_bricks = np.ravel_multi_index(tuple((cubes // brick).T), is_active.shape)
+        new_triangle_bricks = np.repeat(cube_bricks, self.packed_lut[3][configurations] // 3)
+
+        self.verts, self.tris, self.keys = stitch([kept_piece, new_piece])
+        self.triangle_bricks = np.concatenate((self.triangle_bricks[kept], new_triangle_bricks))
+        # only the bricks extracted again are now up to date, the others keep the values their mesh comes from
+        np.copyto(self.potentials, potentials, where=brick_samples(is_dirty, brick, potentials.shape))
+        self.threshold, self.was_active = threshold, np.where(is_dirty, is_active, self.was_active)
+        profile.lap('stitching', self.verts, self.tris, self.keys, self.triangle_bricks)
+        return self.verts, self.tris
@@ -0,0 +1,266 @@
+import numpy as np
+
+
+def open_grid_axes(xx, yy, zz):
+    """
+    Returns the 1-D x, y and z axes if xx, yy and zz are an open grid, shaped (1, X, 1), (Y, 1, 1) and (1, 1, Z)
+    like np.meshgrid(..., sparse=True) returns, else None.
+    """
+    xx, yy, zz = np.asarray(xx), np.asarray(yy), np.asarray(zz)
+    if xx.ndim == yy.ndim == zz.ndim == 3 and xx.shape[::2] == yy.shape[1:] == zz.shape[:2] == (1, 1):
+        return xx[0, :, 0], yy[:, 0, 0], zz[0, 0, :]
+    return None
+
+
+class Field:
+    """
+    An implicit field, evaluated like any sample_fun: field(xx, yy, zz) with broadcastable coordinates, e.g. open grids.
+    Fields add up, and distance fields combine with union and smooth_union.
+    Parameters enter the computations as Python floats, so that float32 coordinates give float32 potentials.
+    """
+
+    def __call__(self, xx, yy, zz):
+        raise NotImplementedError
+
+    def __add__(self, other):
+        return Sum(self, other)
+
+    def union(self, other):
+        return Union(self, other)
+
+    def smooth_union(self, other, k):
+        return SmoothUnion(self, other, k)
+
+
+class Sum(Field):
+
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def __call__(self, xx, yy, zz):
+        return sum(field(xx, yy, zz) for field in self.fields)
+
+
+class Gaussians(Field):
+    """
+    Metaballs: the sum of weights * exp(-|p - centers| ** 2 / (2 * gammas ** 2)) over the blobs.
+    Each blob is truncated beyond the radius where it falls below cutoff, so that the field is off by less than
+    cutoff per blob reaching a point, and a blob is only evaluated over the samples within its bounding box.
+    On open grids the blobs are separable: each is three 1-D exponentials, multiplied over its box only. Other points
+    are sorted along x once, so that the points in each box are found from a run of them.
+    """
+
+    def __init__(self, centers, gammas, weights=1.0, cutoff=1e-6):
+        self.centers = np.atleast_2d(np.asarray(centers, dtype=float))
+        self.gammas = np.broadcast_to(np.asarray(gammas, dtype=float), len(self.centers))
+        self.weights = np.broadcast_to(np.asarray(weights, dtype=float), len(self.centers))
+        self.radii = self.gammas * np.sqrt(2 * np.log(np.maximum(np.abs(self.weights) / cutoff, 1)))
+
+    def bounds(self):
+        """
+        Returns the lower and upper corners of the bounding box of each blob, beyond which it is truncated.
+        """
+        return self.centers - self.radii[:, None], self.centers + self.radii[:, None]
+
+    def __call__(self, xx, yy, zz):
+        axes = open_grid_axes(xx, yy, zz)
+        if axes is not None:
+            return self.sample_grid(*axes)
+
+        coordinates = np.broadcast_arrays(xx, yy, zz)
+        dtype = np.result_type(xx, yy, zz, np.float32)
+        potentials = np.zeros(coordinates[0].size, dtype=dtype)
+        px, py, pz = (c.ravel().astype(dtype, copy=False) for c in coordinates)
+
+        # the points within the box of a blob: a run of the points sorted along x, then those within along y and z
+        order = np.argsort(px, kind='stable')
+        sorted_x = px[order]
+        lower, upper = self.bounds()
+        for center, gamma, weight, low, high in zip(self.centers, self.gammas, self.weights, lower, upper):
+            run = order[np.searchsorted(sorted_x, low[0]):np.searchsorted(sorted_x, high[0], 'right')]
+            within = run[(low[1] <= py[run]) & (py[run] <= high[1]) & (low[2] <= pz[run]) & (pz[run] <= high[2])]
+            cx, cy, cz = (float(c) for c in center)
+            xmmu2 = (px[within] - cx) ** 2 + (py[within] - cy) ** 2 + (pz[within] - cz) ** 2
+            potentials[within] += float(weight) * np.exp(xmmu2 * float(-0.5 / gamma ** 2))
+        return potentials.reshape(coordinates[0].shape)
+
+    def sample_grid(self, x_axis, y_axis, z_axis):
+        """
+        Evaluate over the open grid of the given ascending axes, indexed as [y, x, z].
+        """
+        axes = x_axis, y_axis, z_axis
+        potentials = np.zeros((len(y_axis), len(x_axis), len(z_axis)), dtype=np.result_type(*axes, np.float32))
+        lower, upper = self.bounds()
+        first = np.stack([np.searchsorted(axis, lower[:, dim]) for dim, axis in enumerate(axes)], axis=1)
+        last = np.stack([np.searchsorted(axis, upper[:, dim], 'right') for dim, axis in enumerate(axes)], axis=1)
+        reaching = np.all(first < last, axis=1)
+
+        for center, gamma, weight, start, stop in zip(self.centers[reaching], self.gammas[reaching],
+                                                      self.weights[reaching], first[reaching], last[reaching]):
+            ex, ey, ez = [np.exp((axis[begin:end] - float(c)) ** 2 * float(-0.5 / gamma ** 2))
+                          for axis, c, begin, end in zip(axes, center, start, stop)]
+            ex *= float(weight)
+            potentials[start[1]:stop[1], start[0]:stop[0], start[2]:stop[2]] += \
+                ey[:, None, None] * ex[None, :, None] * ez[None, None, :]
+        return potentials
+
+
+class Sphere(Field):
+    """
+    Signed distance to a sphere, negative inside: the surface is at threshold 0.
+    """
+
+    def __init__(self, center, radius):
+        self.center, self.radius = np.broadcast_to(np.asarray(center, dtype=float), 3), radius
+
+    def __call__(self, xx, yy, zz):
+        cx, cy, cz = (float(c) for c in self.center)
+        return np.sqrt((xx - cx) ** 2 + (yy - cy) ** 2 + (zz - cz) ** 2) - float(self.radius)
+
+
+class Box(Field):
+    """
+    Signed distance to an axis-aligned box of the given half sizes, negative inside.
+    """
+
+    def __init__(self, center, half_sizes):
+        self.center = np.broadcast_to(np.asarray(center, dtype=float), 3)
+        self.half_sizes = np.broadcast_to(np.asarray(half_sizes, dtype=float), 3)
+
+    def __call__(self, xx, yy, zz):
+        qx, qy, qz = (np.abs(coordinates - float(c)) - float(h)
+                      for coordinates, c, h in zip((xx, yy, zz), self.center, self.half_sizes))
+        outside = np.sqrt(np.maximum(qx, 0) ** 2 + np.maximum(qy, 0) ** 2 + np.maximum(qz, 0) ** 2)
+        return outside + np.minimum(np.maximum(np.maximum(qx, qy), qz), 0)
+
+
+class Union(Field):
+    """
+    Union of distance fields: the minimum of both.
+    """
+
+    def __init__(self, first, second):
+        self.first, self.second = first, second
+
+    def __call__(self, xx, yy, zz):
+        return np.minimum(self.first(xx, yy, zz), self.second(xx, yy, zz))
+
+
+class SmoothUnion(Field):
+    """
+    Union of distance fields, blended over a distance k where they are close, with the polynomial smooth minimum.
+    """
+
+    def __init__(self, first, second, k):
+        self.first, self.second, self.k = first, second, k
+
+    def __call__(self, xx, yy, zz):
+        a, b = self.first(xx, yy, zz), self.second(xx, yy, zz)
+        k = float(self.k)
+        h = np.maximum(k - np.abs(a - b), 0) / k
+        return np.minimum(a, b) - h * h * k * 0.25
+
+
+class BinnedGaussians(Gaussians):
+    """
+    Same field as Gaussians, for thousands of blobs: blobs are binned in a uniform grid of bin_size cells, by default
+    twice the largest truncation radius, each blob registered in every bin its bounding box overlaps.
+    The samples in each bin then only accumulate the blobs registered in it: on open grids, as a single matrix
+    product of their 1-D exponentials over the samples of the bin, else over the points in the bin.
+    """
+
+    def __init__(self, centers, gammas, weights=1.0, cutoff=1e-6, bin_size=None):
+        super().__init__(centers, gammas, weights, cutoff)
+        self.bin_size = bin_size or 2 * self.radii.max(initial=0) or 1.0
+        lower, upper = self.bounds()
+        self.origin = lower.min(axis=0) if len(lower) else np.zeros(3)
+        first, last = self.bin_of(lower), self.bin_of(upper)
+        self.bins_shape = tuple(int(size) + 1 for size in last.max(axis=0, initial=0))
+
+        # one row per (bin, blob) overlap, sorted by bin so that the blobs of each bin are contiguous
+        extents = last - first + 1
+        counts = np.prod(extents, axis=1)
+        blobs = np.repeat(np.arange(len(self.centers)), counts)
+        local = np.arange(len(blobs)) - np.repeat(np.cumsum(counts) - counts, counts)
+        ex, ey = extents[blobs, 0], extents[blobs, 1]
+        overlaps = first[blobs] + np.stack((local % ex, local // ex % ey, local // (ex * ey)), axis=-1)
+        keys = np.ravel_multi_index(tuple(overlaps.T), self.bins_shape)
+        order = np.argsort(keys, kind='stable')
+        self.keys, starts = np.unique(keys[order], return_index=True)
+        self.blobs = np.split(blobs[order], starts[1:])
+
+    def bin_of(self, coordinates, dim=slice(None)):
+        """
+        Returns the (x, y, z) index of the bin of each (N, 3) point, possibly out of the bins grid, or along dim
+        only, of 1-D coordinates.
+        """
+        return np.floor((coordinates - self.origin[dim]) / self.bin_size).astype(np.int64)
+
+    def __call__(self, xx, yy, zz):
+        axes = open_grid_axes(xx, yy, zz)
+        if axes is not None:
+            return self.sample_grid(*axes)
+
+        coordinates = np.broadcast_arrays(xx, yy, zz)
+        dtype = np.result_type(*coordinates, np.float32)
+        points = np.stack([c.ravel() for c in coordinates], axis=-1)  # N x 3, the points need not be on a grid
+        potentials = np.zeros(len(points), dtype=dtype)
+
+        bins = self.bin_of(points)
+        is_inside = np.all((0 <= bins) & (bins < self.bins_shape), axis=1)
+        keys = np.full(len(points), -1)
+        keys[is_inside] = np.ravel_multi_index(tuple(bins[is_inside].T), self.bins_shape)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        is_binned = is_inside & (self.keys[positions] == keys) if len(self.keys) else np.zeros(len(points), bool)
+
+        order = np.flatnonzero(is_binned)[np.argsort(positions[is_binned], kind='stable')]
+        groups, starts = np.unique(positions[order], return_index=True)
+        for position, group in zip(groups, np.split(order, starts[1:])):
+            blobs = self.blobs[position]
+            offsets = points[group, None, :] - self.centers[blobs].astype(dtype)  # points x blobs x 3
+            within = np.all(np.abs(offsets) <= self.radii[blobs, None].astype(dtype), axis=-1)
+            exponents = np.einsum('pbd,pbd->pb', offsets, offsets) * (-0.5 / self.gammas[blobs] ** 2).astype(dtype)
+            potentials[group] = (np.exp(exponents) * within) @ self.weights[blobs].astype(dtype)
+        return potentials.reshape(coordinates[0].shape)
+
+    def sample_grid(self, x_axis, y_axis, z_axis):
+        axes = x_axis, y_axis, z_axis
+        dtype = np.result_type(*axes, np.float32)
+        potentials = np.zeros((len(y_axis), len(x_axis), len(z_axis)), dtype=dtype)
+
+        # the samples of a bin are a contiguous run along each axis, bins without samples are skipped
+        runs = []
+        for dim, axis in enumerate(axes):
+            bins, starts = np.unique(self.bin_of(axis, dim), return_index=True)
+            runs.append((bins, starts, np.append(starts[1:], len(axis))))
+        occupied = np.stack(np.unravel_index(self.keys, self.bins_shape), axis=-1)
+        is_sampled = np.all([np.isin(occupied[:, dim], runs[dim][0]) for dim in range(3)], axis=0)
+
+        for position in np.flatnonzero(is_sampled):
+            blobs = self.blobs[position]
+            centers, radii = self.centers[blobs].astype(dtype), self.radii[blobs, None].astype(dtype)
+            factors, box = [], []
+            for dim, (axis, (bins, starts, stops)) in enumerate(zip(axes, runs)):
+                run = np.searchsorted(bins, occupied[position, dim])
+                samples = axis[starts[run]:stops[run]]
+                offsets = samples - centers[:, dim, None]  # blobs x samples
+                factors.append(np.exp(offsets ** 2 * (-0.5 / self.gammas[blobs, None] ** 2).astype(dtype))
+                               * (np.abs(offsets) <= radii))
+                box.append(slice(starts[run], stops[run]))
+            ex, ey, ez = factors
+            ex *= self.weights[blobs, None].astype(dtype)
+            products = (ey[:, :, None] * ex[:, None, :]).reshape(len(blobs), -1)  # blobs x (y, x)
+            potentials[box[1], box[0], box[2]] = (products.T @ ez).reshape(len(ey[0]), len(ex[0]), len(ez[0]))
+        return potentials
+
+    def slices(self, x_axis, y_axis, z_axis):
+        """
+        Yields the z-slices of the field over the open grid of the given ascending axes, indexed as [y, x], computed
+        one slab of bins at a time: only the samples of a slab are in memory. Feed them to v3's render_slices
+        for streaming extraction, with shape (len(y_axis), len(x_axis), len(z_axis)).
+        """
+        _, starts = np.unique(self.bin_of(z_axis, 2), return_index=True)
+        for start, stop in zip(starts, np.append(starts[1:], len(z_axis))):
+            slab = self.sample_grid(x_axis, y_axis, z_axis[start:stop])
+            for k in range(stop - start):
+                yield slab[:, :, k]
@@ -1,6 +1,15 @@
+import functools
+import hashlib
 import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+from profiling import no_profile
+
+cube_tetras = [[0, 1, 2, 4], [0, 1, 4, 7], [0, 2, 3, 4], [1, 2, 4, 5], [1, 4, 7, 5], [1, 6, 5, 7]]
+cube_vertices = np.array(list(itertools.product([0, 1], repeat=3)))[[0, 2, 6, 4, 5, 7, 3, 1]]  # gray-like ordering
+
 
 def surface_from_tetra(cube_indexes, outside):
     """
@@ -49,8 +58,6 @@ def precompute_surface_from_cube():
     Each element of the structure contains a list of vertices given as a pair of cube indexes,
     and a list of faces given as a list of triplets of vertex indexes.
     """
-    cube_tetras = [[0, 1, 2, 4], [0, 1, 4, 7], [0, 2, 3, 4], [1, 2, 4, 5], [1, 4, 7, 5], [1, 6, 5, 7]]
-
     face_lut = []
     for configuration in range(256):
         outside = [configuration >> pow2 & 1 == 1 for pow2 in range(8)]
@@ -65,42 +72,322 @@ def precompute_surface_from_cube():
     return face_lut
 
 
-def render(volume, interval, sample_fun, threshold, face_lut):
+def render(volume, interval, sample_fun, threshold, face_lut, compact=False, sparse=False, profile=no_profile):
+    """
+    If compact is True, the volume is sampled in float32, and float32 vertices of shape (V, 3) and uint32 triangles
+    are returned as NumPy arrays, instead of lists.
+    If sparse is True, sample_fun gets open grids, see sample_volume.
+    Pass a profiling.StageProfile as profile to time the sampling, lut indexing, active cells, interpolation and
+    list building stages.
+    """
 
     #  sample the volume, and get the inside/outside state of each cube
-    x_range, y_range, z_range = [np.arange(volume[dim][0], volume[dim][1] + interval, interval) for dim in range(3)]
-    xx, yy, zz = np.meshgrid(x_range, y_range, z_range)
-    potentials = sample_fun(xx, yy, zz)
-
-    # vertices of the prototype cube
-    vertices = np.array(list(itertools.product([0, 1], repeat=3)))
-    vertices = vertices[[0, 2, 6, 4, 5, 7, 3, 1]]  # gray-like ordering
+    profile.start()
+    x_range, y_range, z_range = sample_ranges(volume, interval, np.float32 if compact else np.float64)
+    potentials = sample_fun(*np.meshgrid(x_range, y_range, z_range, sparse=sparse))
+    potentials = np.broadcast_to(potentials, (len(y_range), len(x_range), len(z_range)))
+    profile.lap('sampling', potentials)
 
     # compute indexes into the lookup table
-    xs, ys, zs = potentials.shape
-    outside = potentials > threshold
-    lut_indexes = np.zeros([d-1 for d in outside.shape], dtype=int)
-    for index, (xd, yd, zd) in enumerate(vertices):
-        lut_indexes += 2 ** index * outside[xd:xs-1+xd, yd:ys-1+yd, zd:zs-1+zd]
+    lut_indexes = lookup_indexes(potentials, threshold)
+    profile.lap('lut indexing', lut_indexes)
 
-    # collect the coordinates and values at each active cube
-    ix, iy, iz = np.nonzero(np.logical_and(0 < lut_indexes, lut_indexes < 255))
-    lut_indexes = lut_indexes[ix, iy, iz]
+    # collect the coordinates and values at each active cube, potentials are indexed as [y, x, z]
+    iy, ix, iz = np.nonzero(np.logical_and(0 < lut_indexes, lut_indexes < 255))
+    lut_indexes = lut_indexes[iy, ix, iz]
     coords, values = [], []
-    for xd, yd, zd in vertices:
-        coords.append(np.stack((xx[ix+xd, iy+yd, iz+zd], yy[ix+xd, iy+yd, iz+zd], zz[ix+xd, iy+yd, iz+zd]), axis=-1))
-        values.append(potentials[ix+xd, iy+yd, iz+zd])
+    for yd, xd, zd in cube_vertices:
+        coords.append(np.stack((x_range[ix+xd], y_range[iy+yd], z_range[iz+zd]), axis=-1))
+        values.append(potentials[iy+yd, ix+xd, iz+zd])
     coords = np.stack(coords, axis=1)
     values = np.stack(values, axis=1)
+    profile.lap('active cells', coords, values)
 
-    # compute interpolated vertices, and build the triangles' index
-    verts, tris = [], []
+    # compute interpolated vertices
+    cube_verts = []
     for lut_index, coord_list, value_list in zip(lut_indexes, coords, values):
-        displacement = len(verts)
-        v_template, f_template = face_lut[lut_index]
+        v_template = face_lut[lut_index][0]
         ts = (threshold - value_list[v_template[:, 1]]) / (value_list[v_template[:, 0]] - value_list[v_template[:, 1]])
-        vs = ts[:, None] * coord_list[v_template[:, 0]] + (1 - ts)[:, None] * coord_list[v_template[:, 1]]
+        cube_verts.append(ts[:, None] * coord_list[v_template[:, 0]] + (1 - ts)[:, None] * coord_list[v_template[:, 1]])
+    profile.lap('interpolation', cube_verts)
+
+    # build the vertex list and the triangles' index
+    verts, tris = [], []
+    for lut_index, vs in zip(lut_indexes, cube_verts):
+        tris.extend(face_lut[lut_index][1] + len(verts))
         verts.extend(vs)
-        tris.extend(f_template + displacement)
 
-    return verts, list(map(int, tris))  # ursina barfs on np.int64
+    if compact:
+        verts, tris = np.array(verts, dtype=np.float32).reshape((-1, 3)), np.array(tris, dtype=np.uint32)
+    else:
+        tris = list(map(int, tris))  # ursina barfs on np.int64
+    profile.lap('list building', verts, tris)
+    return verts, tris
+
+
+def pack_face_lut(face_lut):
+    """
+    Pack the face lookup table into padded arrays, so that all active cubes can be processed at once.
+    Returns (edges, faces, vertex_counts, face_counts) where, for each configuration c:
+      edges[c, :vertex_counts[c]] are the vertices given as a pair of cube indexes
+      faces[c, :face_counts[c]] are the flattened triangles, as indexes into edges[c]
+    """
+    vertex_counts = np.array([len(vertices) for vertices, _ in face_lut], dtype=np.int64)
+    face_counts = np.array([len(faces) for _, faces in face_lut], dtype=np.int64)
+
+    edges = np.zeros((256, vertex_counts.max(), 2), dtype=np.uint8)
+    faces = np.zeros((256, face_counts.max()), dtype=np.uint32)
+    for configuration, (v_template, f_template) in enumerate(face_lut):
+        edges[configuration, :vertex_counts[configuration]] = np.reshape(v_template, (-1, 2))
+        faces[configuration, :face_counts[configuration]] = f_template
+
+    return edges, faces, vertex_counts, face_counts
+
+
+def load_face_lut(cache_dir=os.path.dirname(os.path.abspath(__file__)), version=1):
+    """
+    Returns the packed face lookup table, memory-mapped from a binary file in cache_dir.
+    The file is named after a hash of the tetra decomposition and of version, to be bumped whenever the way the
+    table is built changes: if no matching file exists, the table is computed and saved first.
+    """
+    digest = hashlib.sha1(repr((version, cube_tetras, cube_vertices.tolist())).encode()).hexdigest()[:12]
+    filename = os.path.join(cache_dir, f'face_lut_{digest}.npy')
+
+    if not os.path.exists(filename):
+        edges, faces, vertex_counts, face_counts = pack_face_lut(precompute_surface_from_cube())
+        table = np.zeros(256, dtype=[('edges', np.uint8, edges.shape[1:]), ('faces', np.uint32, faces.shape[1:]),
+                                     ('vertex_counts', np.int64), ('face_counts', np.int64)])
+        table['edges'], table['faces'], table['vertex_counts'], table['face_counts'] = edges, faces, vertex_counts, face_counts
+        temporary = f'{filename}.{os.getpid()}.tmp'  # concurrent workers may race to build it
+        with open(temporary, 'wb') as file:
+            np.save(file, table)
+        os.replace(temporary, filename)
+
+    table = np.load(filename, mmap_mode='r')
+    return table['edges'], table['faces'], table['vertex_counts'], table['face_counts']
+
+
+def sample_ranges(volume, interval, dtype=np.float64):
+    """
+    Returns the x, y and z coordinates of the samples in the volume.
+    """
+    return [np.arange(volume[dim][0], volume[dim][1] + interval, interval).astype(dtype) for dim in range(3)]
+
+
+def sample_volume(volume, interval, sample_fun, dtype=np.float64, sparse=False):
+    """
+    Evaluate sample_fun over the volume. Returns the potentials and the coordinates of the first sample.
+    Potentials are indexed as [y, x, z], like np.meshgrid does.
+    With dtype=np.float32, coordinates are given to sample_fun in single precision, halving peak memory as long
+    as sample_fun keeps to it.
+    If sample_fun only uses broadcasting operations, pass sparse=True: it then gets open grids, i.e. the 1-D axes
+    shaped (1, X, 1), (Y, 1, 1) and (1, 1, Z), instead of three full meshgrids.
+    """
+    x_range, y_range, z_range = sample_ranges(volume, interval, dtype)
+    potentials = sample_fun(*np.meshgrid(x_range, y_range, z_range, sparse=sparse))
+    potentials = np.broadcast_to(potentials, (len(y_range), len(x_range), len(z_range)))  # e.g. for f(x, y, z) = z
+    return potentials, np.array((x_range[0], y_range[0], z_range[0]))
+
+
+def lookup_indexes(potentials, threshold):
+    """
+    Returns the index into the lookup table of each cube, i.e. the inside/outside state of its corners.
+    """
+    xs, ys, zs = potentials.shape
+    outside = potentials > threshold
+    lut_indexes = np.zeros([d - 1 for d in outside.shape], dtype=np.uint8)  # 8 corners, 8 bits
+    for index, (xd, yd, zd) in enumerate(cube_vertices):
+        lut_indexes |= outside[xd:xs - 1 + xd, yd:ys - 1 + yd, zd:zs - 1 + zd].view(np.uint8) << index
+    return lut_indexes
+
+
+def edge_keys(corner_i, corner_j, shape):
+    """
+    Returns an integer identifying the grid edge between corners i and j, the same for (i, j) and (j, i).
+    The key is the linear index of the lowest corner, times 27, plus the direction towards the other one.
+    """
+    strides = np.array([shape[1] * shape[2], shape[2], 1])
+    lin_i, lin_j = corner_i @ strides, corner_j @ strides
+    start = np.where((lin_i < lin_j)[:, None], corner_i, corner_j)
+    direction = (corner_i + corner_j - 2 * start + 1) @ np.array([9, 3, 1])
+    return np.minimum(lin_i, lin_j) * 27 + direction
+
+
+def extract(potentials, threshold, packed_lut, weld=False, offset=(0, 0, 0), shape=None, return_keys=False,
+            normals=False, profile=no_profile):
+    """
+    Vectorized marching tetrahedra over already sampled potentials.
+    Returns the vertices in (fractional) grid index space, and the flattened triangles.
+    Output order is the same as render's: cube by cube, each in its face_lut order.
+    If weld is True, returns an indexed mesh instead: each grid edge crossed by the surface is
+    interpolated once, and shared by all the triangles of the adjacent cubes.
+    When potentials are a block of a larger grid of the given shape, starting at index offset, vertices
+    are returned in the index space of the whole grid. If return_keys is True, the global edge key of
+    each (welded) vertex is also returned, so that meshes of neighbouring blocks can be stitched.
+    If normals is True, unit normals are returned after the triangles, pointing towards lower potentials. They come
+    from the finite differences gradient at the corners, interpolated along the same edges as the vertices.
+    Stages are timed by profile, see render.
+    """
+    lut_indexes = lookup_indexes(potentials, threshold)
+    profile.lap('lut indexing', lut_indexes)
+    cubes = np.stack(np.nonzero(np.logical_and(0 < lut_indexes, lut_indexes < 255)), axis=-1)
+    configurations = lut_indexes[tuple(cubes.T)]
+    profile.lap('active cells', cubes, configurations)
+    return extract_cubes(potentials, threshold, packed_lut, cubes, configurations,
+                         weld, offset, shape, return_keys, normals, profile)
+
+
+def gradient_at(potentials, points):
+    """
+    Central differences gradient of the potentials at (N, 3) integer points, one-sided on the boundary.
+    """
+    gradients = np.empty(points.shape)
+    for axis, step in enumerate(np.eye(3, dtype=int)):
+        after = np.minimum(points + step, np.array(potentials.shape) - 1)
+        before = np.maximum(points - step, 0)
+        gradients[:, axis] = (potentials[tuple(after.T)] - potentials[tuple(before.T)]) / (after - before)[:, axis]
+    return gradients
+
+
+def extract_cubes(potentials, threshold, packed_lut, cubes, configurations,
+                  weld=False, offset=(0, 0, 0), shape=None, return_keys=False, normals=False, profile=no_profile):
+    """
+    Same as extract, for the given active cubes only, as an (N, 3) array of indexes of their first corner,
+    and their indexes into the lookup table.
+    """
+    edges, faces, vertex_counts, face_counts = packed_lut
+
+    # one row per output vertex: the cube it comes from, and the pair of corners it interpolates
+    counts = vertex_counts[configurations]
+    displacements = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(cubes)), counts)
+    pairs = edges[configurations[owner], np.arange(len(owner)) - displacements[owner]]
+    corner_i = cubes[owner] + cube_vertices[pairs[:, 0]]
+    corner_j = cubes[owner] + cube_vertices[pairs[:, 1]]
+    offset = np.asarray(offset)
+    keys = edge_keys(corner_i + offset, corner_j + offset, shape or potentials.shape)
+    if weld:  # keep one vertex per grid edge, and remember where every other copy went
+        keys, unique, welded = np.unique(keys, return_index=True, return_inverse=True)
+        corner_i, corner_j = corner_i[unique], corner_j[unique]
+    value_i, value_j = potentials[tuple(corner_i.T)], potentials[tuple(corner_j.T)]
+    ts = (threshold - value_j) / (value_i - value_j)
+    verts = offset + corner_j + ts[:, None] * (corner_i - corner_j)
+    if normals:
+        gradient_i, gradient_j = gradient_at(potentials, corner_i), gradient_at(potentials, corner_j)
+        gradients = gradient_j + ts[:, None] * (gradient_i - gradient_j)
+        normals = -gradients / np.maximum(np.linalg.norm(gradients, axis=1, keepdims=True), np.finfo(float).tiny)
+    profile.lap('interpolation', verts, keys, *((normals,) if normals is not False else ()))
+
+    # offset each cube's face template by the index of its first vertex
+    counts = face_counts[configurations]
+    owner = np.repeat(np.arange(len(cubes)), counts)
+    tris = faces[configurations[owner], np.arange(len(owner)) - (np.cumsum(counts) - counts)[owner]]
+    tris += displacements[owner].astype(np.uint32)
+    if weld:
+        tris = welded.astype(np.uint32)[tris]
+    profile.lap('triangles', tris)
+
+    return (verts, tris) + ((normals,) if normals is not False else ()) + ((keys,) if return_keys else ())
+
+
+def stitch(pieces):
+    """
+    Merge welded meshes of blocks of the same grid, given as (verts, tris, keys) as returned by extract.
+    Vertices on the boundaries shared by more than one block are kept once.
+    """
+    verts, tris, keys = zip(*pieces)
+    displacements = np.cumsum([0] + [len(block_verts) for block_verts in verts[:-1]])
+    keys, unique, welded = np.unique(np.concatenate(keys), return_index=True, return_inverse=True)
+    tris = np.concatenate([block_tris + displacement for block_tris, displacement in zip(tris, displacements)])
+    return np.concatenate(verts)[unique], welded.astype(np.uint32)[tris], keys
+
+
+def grid_to_world(verts, origin, interval):
+    """
+    Map vertices from grid index space, indexed as [y, x, z], to world coordinates.
+    """
+    return origin + interval * verts[:, [1, 0, 2]]
+
+
+def render_vectorized(volume, interval, sample_fun, threshold, packed_lut, weld=False, normals=False,
+                      dtype=np.float64, sparse=False, profile=no_profile):
+    """
+    Same as render, without Python loops. Takes the output of pack_face_lut, and returns
+    contiguous float32 vertices of shape (V, 3) and uint32 flattened triangles.
+    If weld is True, vertices on grid edges shared by neighbouring cubes are emitted only once.
+    If normals is True, float32 per-vertex normals from the gradient of the field are returned too.
+    dtype and sparse are as in sample_volume, profile as in render.
+    """
+    profile.start()
+    potentials, origin = sample_volume(volume, interval, sample_fun, dtype, sparse)
+    profile.lap('sampling', potentials)
+    if not normals:
+        verts, tris = extract(potentials, threshold, packed_lut, weld, profile=profile)
+        verts = grid_to_world(verts, origin, interval).astype(np.float32)
+        profile.lap('world mapping', verts)
+        return verts, tris
+
+    verts, tris, normals = extract(potentials, threshold, packed_lut, weld, normals=True, profile=profile)
+    verts, normals = grid_to_world(verts, origin, interval).astype(np.float32), normals[:, [1, 0, 2]].astype(np.float32)
+    profile.lap('world mapping', verts, normals)
+    return verts, tris, normals
+
+
+def render_thresholds(volume, interval, sample_fun, thresholds, packed_lut, weld=False, sparse=False):
+    """
+    Same as render_vectorized for several thresholds at once: the volume is sampled and swept only once.
+    Each sample is labelled with the number of thresholds below it, so that a cube is active for the thresholds
+    between the lowest and the highest label of its corners: the cubes active for any threshold are gathered in a
+    single pass, and only those are indexed for each surface.
+    Returns a list of (verts, tris), one per threshold, in the order given. sparse is as in sample_volume.
+    """
+    potentials, origin = sample_volume(volume, interval, sample_fun, sparse=sparse)
+    order = np.argsort(thresholds)
+    sorted_thresholds = np.asarray(thresholds)[order]
+    levels = np.searchsorted(sorted_thresholds, potentials).astype(np.min_scalar_type(len(thresholds)))
+
+    ys, xs, zs = levels.shape
+    corners = [levels[yd:ys - 1 + yd, xd:xs - 1 + xd, zd:zs - 1 + zd] for yd, xd, zd in cube_vertices]
+    lowest, highest = functools.reduce(np.minimum, corners), functools.reduce(np.maximum, corners)
+    cubes = np.stack(np.nonzero(lowest < highest), axis=-1)
+    corner_levels = np.stack([corner[tuple(cubes.T)] for corner in corners], axis=-1)
+    lowest, highest = lowest[tuple(cubes.T)], highest[tuple(cubes.T)]
+
+    surfaces = [None] * len(thresholds)
+    for level, (index, threshold) in enumerate(zip(order, sorted_thresholds)):
+        is_active = np.logical_and(lowest <= level, level < highest)  # potentials > threshold iff levels > level
+        configurations = (corner_levels[is_active] > level) @ 2 ** np.arange(8)
+        verts, tris = extract_cubes(potentials, threshold, packed_lut, cubes[is_active], configurations, weld)
+        surfaces[index] = grid_to_world(verts, origin, interval).astype(np.float32), tris
+    return surfaces
+
+
+def render_slab(volume, interval, sample_fun, threshold, packed_lut, z_first, z_last, sparse=False):
+    """
+    Sample and extract the slab between z indexes z_first and z_last (included) of the volume.
+    Returns the welded mesh in the index space of the whole volume, with its edge keys.
+    """
+    x_range, y_range, z_range = sample_ranges(volume, interval)
+    potentials = sample_fun(*np.meshgrid(x_range, y_range, z_range[z_first:z_last + 1], sparse=sparse))
+    potentials = np.broadcast_to(potentials, (len(y_range), len(x_range), z_last + 1 - z_first))
+    shape = (len(y_range), len(x_range), len(z_range))
+    return extract(potentials, threshold, packed_lut, True, (0, 0, z_first), shape, return_keys=True)
+
+
+def render_parallel(volume, interval, sample_fun, threshold, packed_lut, slabs=os.cpu_count(), executor=ThreadPoolExecutor,
+                    sparse=False):
+    """
+    Same as render_vectorized with weld=True, but sampling and extraction are split in z-slabs run on a pool.
+    Slabs overlap by one sample, and are stitched by their global edge keys.
+    NumPy releases the GIL for most of the work, so threads are the default; pass ProcessPoolExecutor
+    instead if sample_fun does not, as long as sample_fun can be pickled. sparse is as in sample_volume.
+    """
+    z_count = len(sample_ranges(volume, interval)[2])
+    bounds = np.unique(np.linspace(0, z_count - 1, min(slabs, z_count - 1) + 1).astype(int))
+    with executor(len(bounds) - 1) as pool:
+        pieces = pool.map(render_slab, *zip(*[(volume, interval, sample_fun, threshold, packed_lut, z_first, z_last, sparse)
+                                              for z_first, z_last in zip(bounds[:-1], bounds[1:])]))
+        verts, tris, _ = stitch(list(pieces))
+
+    origin = np.array([axis[0] for axis in sample_ranges(volume, interval)])
+    return grid_to_world(verts, origin, interval).astype(np.float32), tris
@@ -0,0 +1,77 @@
+from functools import partial
+
+from jax import jit, vmap
+import jax.numpy as jnp
+import numpy as np
+
+from isosurface2 import cube_vertices, grid_to_world, sample_volume
+
+
+@partial(jit, static_argnames=('max_cubes', 'max_vertices', 'max_indices'))
+def extract_jax(potentials, threshold, packed_lut, max_cubes, max_vertices, max_indices):
+    """
+    Same as isosurface2.extract, compiled with XLA. Since shapes must be known at compile time, the output
+    is written in fixed capacity buffers of max_vertices vertices and max_indices triangle indexes, and only
+    up to max_cubes active cubes are considered. Returns (verts, tris, vertex_count, index_count, cube_count), where
+    counts are the number of valid entries, and of active cubes: if larger than the buffers, or than max_cubes, the
+    capacities were too small.
+    The kernel is compiled once per grid shape and capacities, and reused for any potentials and threshold.
+    """
+    edges, faces, vertex_counts, face_counts = packed_lut
+
+    ys, xs, zs = potentials.shape
+    outside = potentials > threshold
+    lut_indexes = sum(2 ** index * outside[yd:ys - 1 + yd, xd:xs - 1 + xd, zd:zs - 1 + zd].astype(jnp.int32)
+                      for index, (yd, xd, zd) in enumerate(cube_vertices))
+
+    # fixed number of active cubes: unused slots get configuration 0, which has no vertices nor faces
+    is_active = jnp.logical_and(0 < lut_indexes, lut_indexes < 255).ravel()
+    active = jnp.nonzero(is_active, size=max_cubes, fill_value=0)[0]
+    cubes = jnp.stack(jnp.unravel_index(active, lut_indexes.shape), axis=-1)
+    configurations = jnp.where(jnp.arange(max_cubes) < is_active.sum(), lut_indexes.ravel()[active], 0)
+
+    @vmap
+    def interpolate(cube, configuration):
+        corner_i = cube + jnp.asarray(cube_vertices)[edges[configuration, :, 0]]
+        corner_j = cube + jnp.asarray(cube_vertices)[edges[configuration, :, 1]]
+        value_i, value_j = potentials[tuple(corner_i.T)], potentials[tuple(corner_j.T)]
+        ts = (threshold - value_j) / (value_i - value_j)
+        return corner_j + ts[:, None] * (corner_i - corner_j)
+
+    # scatter each cube's vertices and triangles right after those of the previous cubes, dropping the padding
+    counts = vertex_counts[configurations]
+    displacements = jnp.cumsum(counts) - counts
+    slots = displacements[:, None] + jnp.arange(edges.shape[1])
+    slots = jnp.where(jnp.arange(edges.shape[1]) < counts[:, None], slots, max_vertices)
+    verts = jnp.zeros((max_vertices, 3)).at[slots.ravel()].set(
+        interpolate(cubes, configurations).reshape((-1, 3)), mode='drop')
+
+    index_counts = face_counts[configurations]
+    slots = (jnp.cumsum(index_counts) - index_counts)[:, None] + jnp.arange(faces.shape[1])
+    slots = jnp.where(jnp.arange(faces.shape[1]) < index_counts[:, None], slots, max_indices)
+    tris = jnp.zeros(max_indices, dtype=jnp.uint32).at[slots.ravel()].set(
+        (faces[configurations] + displacements[:, None].astype(jnp.uint32)).ravel(), mode='drop')
+
+    return verts, tris, counts.sum(), index_counts.sum(), is_active.sum()
+
+
+def render_jax(volume, interval, sample_fun, threshold, packed_lut, max_cubes=2 ** 16, max_vertices=None, max_indices=None):
+    """
+    Same as isosurface2.render_vectorized, extracting with the compiled kernel of extract_jax.
+    Buffer capacities default to what max_cubes active cubes could possibly need.
+    """
+    potentials, origin = sample_volume(volume, interval, sample_fun)
+    packed_lut = tuple(jnp.asarray(table) for table in packed_lut)
+    max_vertices = max_vertices or max_cubes * packed_lut[0].shape[1]
+    max_indices = max_indices or max_cubes * packed_lut[1].shape[1]
+
+    threshold = jnp.float32(threshold)  # an int threshold would trigger a new compilation
+    verts, tris, vertex_count, index_count, cube_count = extract_jax(
+        jnp.asarray(potentials), threshold, packed_lut, max_cubes, max_vertices, max_indices)
+    if cube_count > max_cubes:  # the cubes past max_cubes were dropped, their vertices are not even counted
+        raise ValueError(f'{cube_count} active cubes do not fit max_cubes={max_cubes}, increase it')
+    if vertex_count > max_vertices or index_count > max_indices:
+        raise ValueError(f'{vertex_count} vertices and {index_count} indexes do not fit the buffers, increase capacities')
+
+    verts = np.asarray(verts[:vertex_count], dtype=np.float64)
+    return grid_to_world(verts, origin, interval).astype(np.float32), np.asarray(tris[:index_count])
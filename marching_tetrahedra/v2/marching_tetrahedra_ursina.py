@@ -1,29 +1,58 @@
 import numpy as np
 import ursina as ua
 
+from background import DoubleBuffer, MeshWorker
 from cool_normals_shader import cool_normals
-from isosurface2 import precompute_surface_from_cube, render
+from fields import Gaussians
+from bricks import IncrementalSurface
+from isosurface2 import extract, grid_to_world, load_face_lut, sample_volume
+from profiling import StageProfile
 
 
-def sample_fun(xx, yy, zz):
+def sample_fun(xx, yy, zz, time=0):  # works on open grids, i.e. xx, yy and zz need only be broadcastable
+    displacement = 0.3 * np.sin(time)
+    gammas = np.array([0.4, 0.2, 0.3])
+    blobs = Gaussians([[-0.5, 0, 0], [-0.2, 0.7, 0], [0.5 + displacement, 0, 0]], gammas, (2 * np.pi) ** 0.5 / gammas)
+    return blobs(xx, yy, zz)  # stays in the dtype of xx
 
-    def gaussian_3d(mu, gamma):
-        xmmu = np.linalg.norm(np.stack([xx, yy, zz], axis=-1) - mu, axis=-1)  # x minus mu
-        return np.exp(-xmmu ** 2 / (2 * gamma ** 2)) / gamma * np.sqrt(2 * np.pi)
 
-    displacement = 0.3 * np.sin(ua.time.time())
-    return gaussian_3d([-0.5, 0, 0], 0.4) + gaussian_3d([-0.2, 0.7, 0], 0.2) + gaussian_3d([0.5 + displacement, 0, 0], 0.3)
+face_lut = load_face_lut()
+incremental = IncrementalSurface(face_lut)  # only the bricks around the moving gaussian are extracted again
+profile, display = StageProfile(), StageProfile()  # where the time goes, press p to print it
+vertex_buffers = DoubleBuffer()  # the worker fills one while the other is displayed
+# verts, tris = extract(sample_volume(((-1, 1),) * 3, 0.04, sample_fun, np.float32, sparse=True)[0], 6, face_lut)  # if commented below, compute once here
 
 
-face_lut = precompute_surface_from_cube()
-# verts, tris = render(((-1, 1),) * 3, 0.04, sample_fun, 6, face_lut)  # if commented below, compute once here
+def make_mesh(time):
+    profile.start()
+    potentials, origin = sample_volume(((-1, 1), ) * 3, 0.04, lambda *xyz: sample_fun(*xyz, time), np.float32, sparse=True)
+    profile.lap('sampling', potentials)
+    verts, tris = incremental.update(potentials, 6, atol=1e-4, profile=profile)  # comment to test engine performance
+    world_verts = vertex_buffers.back(len(verts))
+    world_verts[:] = grid_to_world(verts, origin, 0.04)
+    triangles = tris.tolist()  # ursina barfs on numpy integers
+    profile.lap('world mapping', world_verts, triangles)
+    return world_verts, triangles
+
+
+background = True  # extract the next mesh on a worker thread, while the current one is displayed
+worker = MeshWorker(make_mesh)
 
 
 def update():
-    verts, tris = render(((-1, 1), ) * 3, 0.04, sample_fun, 6, face_lut)  # comment to test engine performance
-    surface.model.vertices = verts
-    surface.model.triangles = tris
-    surface.model.generate()
+    display.start()
+    mesh = worker.poll(ua.time.time()) if background else make_mesh(ua.time.time())
+    if mesh is not None:  # else the worker is still busy, keep showing the previous mesh
+        surface.model.vertices, surface.model.triangles = mesh
+        surface.model.generate()
+        display.lap('mesh upload')
+
+
+def input(key):
+    if key == 'p':
+        print(f'extraction {profile}\ndisplay {display}')
+        profile.reset()
+        display.reset()
 
 
 if __name__ == '__main__':
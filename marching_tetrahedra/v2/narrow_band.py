@@ -0,0 +1,66 @@
+import numpy as np
+
+from bricks import brick_cubes, brick_reduce, cube_configurations
+from isosurface2 import cube_vertices, extract_cubes, grid_to_world, sample_ranges
+
+
+class SparseVolume:
+    """
+    Potentials known only inside some bricks of brick^3 cubes of a grid of the given shape.
+    Samples are stored by linear index, and looked up like a dense array of potentials, e.g. potentials[iy, ix, iz].
+    """
+
+    def __init__(self, shape, brick, bricks, samples, values):
+        self.shape, self.brick, self.bricks = shape, brick, bricks
+        self.samples, self.values = samples, values  # sorted linear indexes, and the potentials there
+
+    def __getitem__(self, index):
+        return self.values[np.searchsorted(self.samples, np.ravel_multi_index(index, self.shape))]
+
+
+def sample_narrow_band(volume, interval, sample_fun, threshold, stride=4, band=0, dilate=1):
+    """
+    Evaluate sample_fun only near the iso-surface at level threshold. The volume is sampled every stride samples
+    first, and only the cells of this coarse grid whose [min, max] range, widened by band, straddles the threshold
+    are sampled at full resolution, together with dilate more cells around them.
+    Features smaller than a coarse cell can be missed: increase band or dilate, or decrease stride, if it matters.
+    sample_fun gets flat arrays of coordinates. Returns a SparseVolume, and the coordinates of the first sample.
+    """
+    x_range, y_range, z_range = sample_ranges(volume, interval)
+    shape = (len(y_range), len(x_range), len(z_range))
+    coarse = [np.minimum(np.arange(-(-(n - 1) // stride) + 1) * stride, n - 1) for n in shape]
+
+    yy, xx, zz = np.meshgrid(y_range[coarse[0]], x_range[coarse[1]], z_range[coarse[2]], indexing='ij')
+    potentials = sample_fun(xx, yy, zz)
+    is_near = np.logical_and(brick_reduce(potentials, 1, np.minimum) - band <= threshold,
+                             threshold < brick_reduce(potentials, 1, np.maximum) + band)
+    for _ in range(dilate):  # two reductions over 2x2x2 neighbours of the padded cells, i.e. over 3x3x3
+        is_near = brick_reduce(brick_reduce(np.pad(is_near, 1), 1, np.logical_or), 1, np.logical_or)
+
+    # fine samples of the selected coarse cells, each evaluated once even if shared between cells
+    bricks = np.stack(np.nonzero(is_near), axis=-1)
+    cubes = brick_cubes(bricks, stride, shape)
+    samples = np.unique(np.ravel_multi_index(tuple((cubes[:, None, :] + cube_vertices).reshape((-1, 3)).T), shape))
+    iy, ix, iz = np.unravel_index(samples, shape)
+    values = sample_fun(x_range[ix], y_range[iy], z_range[iz])
+
+    return SparseVolume(shape, stride, bricks, samples, values), np.array((x_range[0], y_range[0], z_range[0]))
+
+
+def extract_narrow_band(potentials, threshold, packed_lut, weld=False):
+    """
+    Same as isosurface2.extract, over a SparseVolume.
+    """
+    cubes = brick_cubes(potentials.bricks, potentials.brick, potentials.shape)
+    configurations = cube_configurations(potentials, threshold, cubes)
+    is_active = np.logical_and(0 < configurations, configurations < 255)
+    return extract_cubes(potentials, threshold, packed_lut, cubes[is_active], configurations[is_active], weld)
+
+
+def render_narrow_band(volume, interval, sample_fun, threshold, packed_lut, weld=False, stride=4):
+    """
+    Same as isosurface2.render_vectorized, but sample_fun is only evaluated in a narrow band around the surface.
+    """
+    potentials, origin = sample_narrow_band(volume, interval, sample_fun, threshold, stride)
+    verts, tris = extract_narrow_band(potentials, threshold, packed_lut, weld)
+    return grid_to_world(verts, origin, interval).astype(np.float32), tris
@@ -0,0 +1,169 @@
+import itertools
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+
+from isosurface2 import extract, grid_to_world, sample_ranges
+from profiling import no_profile
+
+
+def save_atomically(filename, save, *args, **kwargs):
+    """
+    Write through a temporary file renamed into place, so that an interrupted run never leaves a partial file.
+    """
+    temporary = f'{filename}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        save(file, *args, **kwargs)
+    os.replace(temporary, filename)
+
+
+class BrickJob:
+    """
+    Out-of-core marching tetrahedra of sample_fun over a large volume, as a batch job over bricks of brick cubes per
+    side, with all state in directory:
+    - job.json: the grid, and the range of values of each brick sampled so far,
+    - samples_y_x_z.npy: the potentials of each brick, one sample wider than its cubes, if keep_samples,
+    - threshold_<threshold>/mesh_y_x_z.npz: the welded mesh of each brick straddling that threshold, e.g. threshold_6.0
+      for any of 6, 6.0 or np.float32(6).
+    A run skips the bricks whose mesh is already on disk, so an interrupted job resumes where it stopped, and the bricks
+    whose range does not straddle the threshold, without sampling them again. Sampled bricks are kept in an LRU cache of
+    max_cached bricks, in front of the samples on disk: a run with another threshold only redoes the extraction.
+    The directory must be used with the same sample_fun only, it cannot be checked.
+    """
+
+    def __init__(self, directory, volume, interval, sample_fun, brick=64, max_cached=8, dtype=np.float64, sparse=False,
+                 keep_samples=True):
+        self.directory, self.sample_fun, self.brick, self.max_cached = directory, sample_fun, brick, max_cached
+        self.dtype, self.sparse, self.keep_samples = dtype, sparse, keep_samples
+        self.x_range, self.y_range, self.z_range = sample_ranges(volume, interval, dtype)
+        self.shape = (len(self.y_range), len(self.x_range), len(self.z_range))
+        self.origin, self.interval = np.array((self.x_range[0], self.y_range[0], self.z_range[0])), interval
+        self.cache = OrderedDict()
+
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = {'volume': [list(bounds) for bounds in volume], 'interval': interval, 'brick': brick,
+                         'shape': list(self.shape), 'dtype': np.dtype(dtype).str, 'ranges': {}}
+        if os.path.exists(self.path('job.json')):
+            with open(self.path('job.json')) as file:
+                manifest = json.load(file)
+            if {key: manifest[key] for key in self.manifest if key != 'ranges'} != \
+                    {key: value for key, value in self.manifest.items() if key != 'ranges'}:
+                raise ValueError(f'{directory} holds a job over another grid, use a new directory')
+            self.manifest['ranges'] = manifest['ranges']
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def mesh_path(self, threshold, index=None):
+        """
+        The directory of the meshes of threshold, or the mesh of the brick at index in it. Thresholds are named as
+        Python floats, so that equal thresholds of other types share it.
+        """
+        directory = self.path(f'threshold_{float(threshold)!r}')
+        return directory if index is None else os.path.join(directory, 'mesh_{}_{}_{}.npz'.format(*index))
+
+    def bricks(self):
+        """
+        Returns the (y, x, z) index of every brick, bricks on the far sides may be smaller.
+        """
+        counts = [-(-(size - 1) // self.brick) for size in self.shape]  # cubes per side, divided rounding up
+        return list(itertools.product(*map(range, counts)))
+
+    def slices(self, index):
+        """
+        The slices of the samples of a brick into the whole grid, including the last samples shared with the next one.
+        """
+        return tuple(slice(i * self.brick, min((i + 1) * self.brick + 1, size)) for i, size in zip(index, self.shape))
+
+    def samples(self, index):
+        """
+        Returns the potentials of a brick: from the cache, else from disk, else sampled, then cached.
+        """
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+
+        name = self.path('samples_{}_{}_{}.npy'.format(*index))
+        if os.path.exists(name):
+            potentials = np.load(name)
+        else:
+            ys, xs, zs = self.slices(index)
+            potentials = self.sample_fun(*np.meshgrid(self.x_range[xs], self.y_range[ys], self.z_range[zs],
+                                                      sparse=self.sparse))
+            potentials = np.ascontiguousarray(np.broadcast_to(potentials, [s.stop - s.start for s in (ys, xs, zs)]))
+            if self.keep_samples:
+                save_atomically(name, np.save, potentials)
+        self.manifest['ranges']['{}_{}_{}'.format(*index)] = [float(potentials.min()), float(potentials.max())]
+
+        self.cache[index] = potentials
+        if len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return potentials
+
+    def is_active(self, index, threshold):
+        """
+        True if the brick may straddle threshold: its range is unknown before it is first sampled.
+        """
+        value_range = self.manifest['ranges'].get('{}_{}_{}'.format(*index))
+        return value_range is None or value_range[0] <= threshold < value_range[1]
+
+    def run(self, threshold, packed_lut, profile=no_profile):
+        """
+        Extract and save the mesh of every brick straddling threshold, not yet done. Returns the number of bricks
+        extracted in this run. Takes the output of pack_face_lut, profile is as in isosurface2.render.
+        """
+        os.makedirs(self.mesh_path(threshold), exist_ok=True)
+        extracted = 0
+        try:
+            for index in self.bricks():
+                name = self.mesh_path(threshold, index)
+                if os.path.exists(name) or not self.is_active(index, threshold):
+                    continue
+                profile.start()
+                potentials = self.samples(index)
+                profile.lap('sampling', potentials)
+                if self.is_active(index, threshold):  # now that its range is known
+                    offset = [s.start for s in self.slices(index)]
+                    verts, tris, keys = extract(potentials, threshold, packed_lut, weld=True, offset=offset,
+                                                shape=self.shape, return_keys=True, profile=profile)
+                    save_atomically(name, np.savez, verts=verts, tris=tris, keys=keys)
+                    profile.lap('saving')
+                    extracted += 1
+        finally:  # ranges missing after a crash only cost sampling those bricks again
+            save_atomically(self.path('job.json'), lambda file: file.write(json.dumps(self.manifest).encode()))
+        return extracted
+
+    def merge(self, threshold):
+        """
+        Yields the mesh of threshold one brick at a time, as (verts, tris) chunks like v3's render_slices: the float32
+        world coordinates of the vertices first seen in the brick, and uint32 triangles indexing the whole mesh, e.g.
+        to stream to disk with v3's mesh_io. Vertices on the seams between bricks are merged by their edge key: only
+        the keys of seam vertices are kept in memory.
+        """
+        seam_keys, seam_ids = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        vertex_count = 0
+        for index in self.bricks():
+            name = self.mesh_path(threshold, index)
+            if not os.path.exists(name):
+                if self.is_active(index, threshold):
+                    raise ValueError(f'brick {index} was not extracted at threshold {threshold!r}, run the job first')
+                continue
+            with np.load(name) as mesh:
+                verts, tris, keys = mesh['verts'], mesh['tris'], mesh['keys']
+
+            is_seen = np.isin(keys, seam_keys)
+            ids = np.empty(len(keys), dtype=np.int64)
+            ids[is_seen] = seam_ids[np.searchsorted(seam_keys, keys[is_seen])]
+            ids[~is_seen] = vertex_count + np.arange(len(keys) - np.count_nonzero(is_seen))
+            vertex_count += len(keys) - np.count_nonzero(is_seen)
+
+            # an edge lies on a seam if both its corners are on a brick boundary plane
+            start = np.stack(np.unravel_index(keys // 27, self.shape), axis=-1)
+            end = start + np.stack((keys // 9 % 3, keys // 3 % 3, keys % 3), axis=-1) - 1
+            on_seam = np.any((start % self.brick == 0) & (start == end), axis=1) & ~is_seen
+            seam_keys, order = np.unique(np.concatenate((seam_keys, keys[on_seam])), return_index=True)
+            seam_ids = np.concatenate((seam_ids, ids[on_seam]))[order]
+
+            new_verts = grid_to_world(verts[~is_seen], self.origin, self.interval)
+            yield new_verts.astype(np.float32), ids[tris].astype(np.uint32)
@@ -0,0 +1,244 @@
+import numpy as np
+
+
+def face_quadrics(verts, tris):
+    """
+    Returns the (V, 4, 4) error quadric of each vertex: the sum over its triangles of the squared distance to their
+    planes, weighted by area, as in Garland and Heckbert's "Surface Simplification Using Quadric Error Metrics".
+    """
+    corners = verts[tris.reshape((-1, 3))]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = normals / np.maximum(areas, np.finfo(float).tiny)
+    planes = np.concatenate((normals, -np.sum(normals * corners[:, 0], axis=1, keepdims=True)), axis=1)
+    weights = areas[:, 0] / 2
+
+    # scatter-add to the 3 corners of each triangle, the upper triangle only since quadrics are symmetric
+    corner_indexes = [np.ascontiguousarray(tris.reshape((-1, 3))[:, k]) for k in range(3)]
+    accumulated = np.empty((len(verts), 4, 4))
+    for i, j in zip(*np.triu_indices(4)):
+        component = planes[:, i] * planes[:, j] * weights
+        accumulated[:, i, j] = accumulated[:, j, i] = sum(np.bincount(indexes, weights=component, minlength=len(verts))
+                                                          for indexes in corner_indexes)
+    return accumulated
+
+
+def mesh_edges(tris):
+    """
+    Returns the unique (E, 2) edges of the triangles, with start < end, and how many triangles share each of them.
+    """
+    triangles = tris.reshape((-1, 3)).astype(np.int64)
+    edges = np.sort(np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]])), axis=1)
+    count = edges.max(initial=0) + 1
+    keys, counts = np.unique(edges[:, 0] * count + edges[:, 1], return_counts=True)  # much faster than axis=0
+    return np.stack((keys // count, keys % count), axis=-1), counts
+
+
+def non_manifold_vertices(triangles):
+    """
+    Returns the vertices of the (T, 3) triangles on an edge shared by more than two of them, or on a duplicate triangle.
+    """
+    edges, counts = mesh_edges(triangles.ravel())
+    ordered, count = np.sort(triangles, axis=1).astype(np.int64), triangles.max(initial=0) + 1
+    _, pairs = np.unique(ordered[:, 0] * count + ordered[:, 1], return_inverse=True)  # much faster than axis=0
+    _, inverse, copies = np.unique(pairs * count + ordered[:, 2], return_inverse=True, return_counts=True)
+    return np.union1d(edges[counts > 2].ravel(), triangles[copies[inverse] > 1].ravel())
+
+
+def solve_3x3(matrices, vectors, fallback):
+    """
+    Solve a batch of symmetric 3x3 linear systems with Cramer's rule, much faster than np.linalg.solve on tiny
+    matrices. Systems whose determinant is ~0, relative to the scale of their matrix, get the fallback solution instead.
+    """
+    (a, b, c), (d, e), f = matrices[:, 0].T, matrices[:, 1, 1:].T, matrices[:, 2, 2]
+    adjugate = [[d * f - e * e, c * e - b * f, b * e - c * d],
+                [None, a * f - c * c, b * c - a * e],
+                [None, None, a * d - b * b]]
+    for i, j in [(1, 0), (2, 0), (2, 1)]:  # symmetric too
+        adjugate[i][j] = adjugate[j][i]
+    determinants = a * adjugate[0][0] + b * adjugate[0][1] + c * adjugate[0][2]
+    solvable = np.abs(determinants) > 1e-12 * np.abs(matrices).max(axis=(1, 2), initial=0) ** 3
+    determinants = np.where(solvable, determinants, 1)
+    solutions = np.stack([sum(row[j] * vectors[:, j] for j in range(3)) / determinants for row in adjugate], axis=-1)
+    return np.where(solvable[:, None], solutions, fallback)
+
+
+def collapse_targets(verts, quadrics, edges, min_regularization):
+    """
+    Returns the point each of the (E, 2) edges collapses to, minimizing the summed quadrics of its endpoints, slightly
+    pulled towards its midpoint so that flat regions stay well posed, and the cost of the collapse.
+    """
+    summed = quadrics[edges[:, 0]] + quadrics[edges[:, 1]]
+    midpoints = (verts[edges[:, 0]] + verts[edges[:, 1]]) / 2
+    regularization = 1e-6 * np.trace(summed[:, :3, :3], axis1=1, axis2=2)[:, None] + min_regularization
+    targets = solve_3x3(summed[:, :3, :3] + regularization[:, :, None] * np.eye(3),
+                        regularization * midpoints - summed[:, :3, 3], midpoints)
+    homogeneous = np.concatenate((targets, np.ones((len(targets), 1))), axis=1)
+    return targets, np.einsum('ei,eij,ej->e', homogeneous, summed, homogeneous)
+
+
+def match_cheapest(edges, costs, candidates, vertex_count, rounds=3):
+    """
+    Returns the candidate edges that are the cheapest of both their endpoints, then the same among the candidates
+    whose endpoints are still free, a few times over. Ties go to the first edge: no two of them share a vertex.
+    """
+    is_free, selected = np.ones(vertex_count, dtype=bool), []
+    for _ in range(rounds):
+        candidates = candidates[np.all(is_free[edges[candidates]], axis=1)]
+        cheapest = np.full(vertex_count, np.inf)
+        np.minimum.at(cheapest, edges[candidates, 0], costs[candidates])
+        np.minimum.at(cheapest, edges[candidates, 1], costs[candidates])
+        tied = candidates[np.all(cheapest[edges[candidates]] == costs[candidates, None], axis=1)]
+        first = np.full(vertex_count, len(edges))
+        np.minimum.at(first, edges[tied, 0], tied)
+        np.minimum.at(first, edges[tied, 1], tied)
+        selected.append(tied[np.all(first[edges[tied]] == tied[:, None], axis=1)])
+        is_free[edges[selected[-1]].ravel()] = False
+    return np.concatenate(selected)
+
+
+def decimate(verts, tris, target, max_passes=100):
+    """
+    Quadric error decimation of a welded mesh, down to about target triangles.
+    Edge collapses are applied in batches: on each pass, every edge that is the cheapest of both its endpoints is
+    collapsed to the point minimizing their summed quadrics, all at once. Collapses that would flip a triangle or
+    make the mesh non-manifold (i.e. whose endpoints do not share exactly two neighbours, or that merge an edge or a
+    triangle with another one of the same batch), and those touching the mesh boundary, are skipped, and not
+    considered again until an endpoint moves. Zero area triangles are dropped first.
+    The edges, with their collapse targets and costs, are kept from pass to pass: only those around the merged
+    vertices are replaced, so that each pass costs a few linear scans of the triangles, and no sort of all of them.
+    That is still about 9 s per million triangles: an offline stage, not an interactive one.
+    Returns the new (verts, tris), with unused vertices removed.
+    """
+    verts, tris = np.array(verts, dtype=np.float64), np.array(tris, dtype=np.int64)
+    # zero area triangles, from thresholds tied with samples, add nothing to the quadrics: vertices only they use
+    # would have none at all
+    corners = verts[tris.reshape((-1, 3))]
+    areas = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+    triangles = tris.reshape((-1, 3))[areas > 0]
+    quadrics = face_quadrics(verts, triangles.ravel())
+    # the smallest pull towards the midpoint, in proportion to the typical triangle area
+    min_regularization = 1e-6 * np.mean(np.trace(quadrics[:, :3, :3], axis1=1, axis2=2)) if len(triangles) else 0.0
+
+    # collapses never touch the boundary, which therefore never changes
+    edges, counts = mesh_edges(triangles.ravel())
+    on_boundary = np.zeros(len(verts), dtype=bool)
+    on_boundary[edges[counts == 1].ravel()] = True
+    edges = edges[~np.any(on_boundary[edges], axis=1)]
+    targets, costs = collapse_targets(verts, quadrics, edges, min_regularization)
+    is_rejected = np.zeros(len(edges), dtype=bool)
+
+    for _ in range(max_passes):
+        excess = len(triangles) - target
+        if excess <= 0:
+            break
+
+        selected = match_cheapest(edges, costs, np.flatnonzero(~is_rejected), len(verts))
+        if len(selected) == 0:
+            break
+        selected = selected[np.argsort(costs[selected], kind='stable')][:excess // 2 + 1]
+
+        # move both endpoints, and reject collapses flipping any of the surviving triangles around them: only the
+        # triangles touching a selected edge can change
+        is_touched = np.zeros(len(verts), dtype=bool)
+        is_touched[edges[selected].ravel()] = True
+        is_local = np.any(is_touched[triangles], axis=1)
+        local = triangles[is_local]
+        moved = verts.copy()
+        moved[edges[selected].ravel()] = np.repeat(targets[selected], 2, axis=0)
+        remap = np.arange(len(verts))
+        remap[edges[selected, 1]] = edges[selected, 0]
+        collapsed = remap[local]
+        surviving = np.all(collapsed[:, [0, 1, 2]] != collapsed[:, [1, 2, 0]], axis=1)
+        old, new = verts[local], moved[local]
+        flipped = np.einsum('ij,ij->i', np.cross(old[:, 1] - old[:, 0], old[:, 2] - old[:, 0]),
+                            np.cross(new[:, 1] - new[:, 0], new[:, 2] - new[:, 0])) <= 0
+        rejected = np.zeros(len(verts), dtype=bool)
+        rejected[local[np.logical_and(surviving, flipped)].ravel()] = True
+        is_flipping = np.any(rejected[edges[selected]], axis=1)
+        is_rejected[selected[is_flipping]] = True
+        selected = selected[~is_flipping]
+
+        # a collapse whose endpoints share more than the two neighbours opposite their edge merges two edges to one
+        # of them into an edge of four triangles, or two triangles into one, and so do collapses of the same batch
+        # conflicting with each other: drop those around the damage, until there is none
+        while True:
+            start, end = edges[selected, 0], edges[selected, 1]
+            remap = np.arange(len(verts))
+            remap[end] = start
+            collapsed = remap[local]
+            collapsed = collapsed[np.all(collapsed[:, [0, 1, 2]] != collapsed[:, [1, 2, 0]], axis=1)]
+            is_merged = np.zeros(len(verts), dtype=bool)
+            is_merged[start] = True
+            around = collapsed[np.any(is_merged[collapsed], axis=1)]
+            is_damaged = np.isin(start, non_manifold_vertices(around))
+            if not np.any(is_damaged):
+                break
+            is_rejected[selected[is_damaged]] = True
+            selected = selected[~is_damaged]
+
+        verts[start] = targets[selected]
+        quadrics[start] += quadrics[end]
+        triangles = np.concatenate((triangles[~is_local], collapsed))
+
+        # the edges of merged vertices are replaced by those around them now, with new targets and costs
+        is_merged[end] = True
+        kept = ~np.any(is_merged[edges], axis=1)
+        new_edges, _ = mesh_edges(around.ravel())
+        new_edges = new_edges[np.any(is_merged[new_edges], axis=1) & ~np.any(on_boundary[new_edges], axis=1)]
+        new_targets, new_costs = collapse_targets(verts, quadrics, new_edges, min_regularization)
+        edges = np.concatenate((edges[kept], new_edges))
+        targets, costs = np.concatenate((targets[kept], new_targets)), np.concatenate((costs[kept], new_costs))
+        is_rejected = np.concatenate((is_rejected[kept], np.zeros(len(new_edges), dtype=bool)))
+
+    used, tris = np.unique(triangles, return_inverse=True)
+    return verts[used].astype(np.float32), tris.reshape(-1).astype(np.uint32)
+
+
+def morton_codes(points, bits=10):
+    """
+    Returns the Z-order curve index of each point, quantized to bits per axis within their bounding box.
+    """
+    low, high = points.min(axis=0), points.max(axis=0)
+    quantized = ((points - low) / np.maximum(high - low, np.finfo(float).tiny) * (2 ** bits - 1)).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(bits):
+        for axis in range(3):
+            codes |= ((quantized[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3 * bit + axis)
+    return codes
+
+
+def optimize_vertex_cache(verts, tris, cache_size=32):
+    """
+    Reorder triangles so that consecutive ones share vertices more often while these are still in the GPU
+    post-transform cache, and vertices in the order they are first used, so that they are fetched sequentially.
+    Vertices are ranked along a Z-order curve whose cells hold a few cache sizes of them, and triangles sorted by
+    their lowest ranked vertex: this walks the surface tile by tile, fanning around each vertex in turn.
+    Returns the same mesh as new (verts, tris).
+    """
+    triangles = tris.reshape((-1, 3))
+    bits = max(1, round(np.log(max(len(verts), 1) / (4 * cache_size)) / np.log(4)))  # a surface covers ~4^bits cells
+    ranks = np.empty(len(verts), dtype=np.int64)
+    ranks[np.argsort(morton_codes(verts, bits), kind='stable')] = np.arange(len(verts))
+    triangles = triangles[np.lexsort((ranks[triangles].max(axis=1), ranks[triangles].min(axis=1)))]
+
+    first_use = np.full(len(verts), triangles.size)
+    np.minimum.at(first_use, triangles.ravel(), np.arange(triangles.size))
+    order = np.argsort(first_use, kind='stable')
+    remap = np.empty(len(verts), dtype=np.uint32)
+    remap[order] = np.arange(len(verts))
+    used = first_use[order] < triangles.size
+    return verts[order[used]], remap[triangles].ravel()
+
+
+def cache_miss_ratio(tris, cache_size=32):
+    """
+    Average number of vertices transformed per triangle, for a FIFO post-transform cache of cache_size entries.
+    Between 0.5 and 3, lower is better. Simulated in Python: slow, but handy to compare orderings.
+    """
+    cache, misses = [], 0
+    for index in tris.tolist():
+        if index not in cache:
+            misses += 1
+            cache = cache[-(cache_size - 1):] + [index]
+    return misses / (len(tris) // 3)
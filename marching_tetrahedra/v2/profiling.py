@@ -0,0 +1,79 @@
+import sys
+import time
+from collections import defaultdict
+
+
+class NoProfile:
+    """
+    The default profile of the render functions: records nothing, at the cost of a method call per stage.
+    """
+
+    def start(self):
+        pass
+
+    def lap(self, stage, *outputs):
+        pass
+
+
+no_profile = NoProfile()
+
+
+def size_of(output):
+    """
+    Bytes held by an array, or by a list of arrays or numbers and its items.
+    """
+    if hasattr(output, 'nbytes'):
+        return output.nbytes
+    if isinstance(output, (list, tuple)):
+        return sys.getsizeof(output) + sum(item.nbytes if hasattr(item, 'nbytes') else sys.getsizeof(item)
+                                           for item in output)
+    return sys.getsizeof(output)
+
+
+class StageProfile:
+    """
+    Per-stage wall time and allocation size, aggregated over the calls of the render functions, e.g. one per frame.
+    Pass it as their profile argument: each stage then reports, through lap, the time since the previous stage ended
+    and the bytes of the arrays it produced. If given, callback(stage, seconds, nbytes) is also called on each lap.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.seconds, self.nbytes, self.laps = defaultdict(float), defaultdict(int), defaultdict(int)
+        self.last = time.perf_counter()
+
+    def start(self):
+        """
+        Start timing a new frame.
+        """
+        self.frames += 1
+        self.last = time.perf_counter()
+
+    def lap(self, stage, *outputs):
+        """
+        Record the time since the previous lap, or start, as spent in stage, and the size of its outputs.
+        """
+        seconds = time.perf_counter() - self.last
+        nbytes = sum(map(size_of, outputs))
+        self.seconds[stage] += seconds
+        self.nbytes[stage] += nbytes
+        self.laps[stage] += 1
+        if self.callback is not None:
+            self.callback(stage, seconds, nbytes)
+        self.last = time.perf_counter()  # leave the bookkeeping out of the next stage
+
+    def summary(self):
+        """
+        Returns {stage: (milliseconds, megabytes)} per frame, on average, in the order stages were first seen.
+        """
+        frames = max(self.frames, 1)
+        return {stage: (1e3 * self.seconds[stage] / frames, self.nbytes[stage] / frames / 2 ** 20)
+                for stage in self.seconds}
+
+    def __str__(self):
+        return f'{self.frames} frames: ' + ', '.join(f'{stage} {milliseconds:.2f}ms {megabytes:.1f}MB'
+                                                    for stage, (milliseconds, megabytes) in self.summary().items())
@@ -0,0 +1,62 @@
+import numpy as np
+
+from bricks import IncrementalSurface
+from isosurface2 import extract, load_face_lut
+
+packed_lut = load_face_lut()
+
+
+def blob(size, center=(0.5, 0.5, 0.5), radius=0.3):
+    """
+    Potentials of a sphere of the given radius, on size samples per side of the unit cube, positive inside.
+    """
+    points = np.indices((size,) * 3) / (size - 1)
+    return radius ** 2 - sum((axis - c) ** 2 for axis, c in zip(points, center))
+
+
+def assert_same_surface(incremental, potentials, threshold):
+    """
+    The incremental mesh must be the welded mesh of potentials, up to the order of its vertices and triangles.
+    """
+    verts, tris, keys = extract(potentials, threshold, packed_lut, weld=True, return_keys=True)
+    assert np.array_equal(np.sort(incremental.keys), keys)
+    order = np.argsort(incremental.keys)
+    np.testing.assert_allclose(incremental.verts[order], verts)
+
+    def triangle_keys(tris, keys):
+        triangles = keys[tris.reshape((-1, 3))]
+        first = np.argmin(triangles, axis=1)[:, None]  # rotate each triangle to start at its lowest key
+        triangles = np.take_along_axis(triangles, (first + np.arange(3)) % 3, axis=1)
+        return triangles[np.lexsort(triangles.T[::-1])]
+
+    assert np.array_equal(triangle_keys(incremental.tris, incremental.keys), triangle_keys(tris, keys))
+
+
+def test_shape_change():
+    incremental = IncrementalSurface(packed_lut)
+    for size in (40, 20, 33):
+        potentials = blob(size)
+        incremental.update(potentials, 0)
+        assert_same_surface(incremental, potentials, 0)
+
+
+def test_threshold_change():
+    incremental = IncrementalSurface(packed_lut)
+    potentials = blob(32)
+    for threshold in (0, 0.02, -0.01):
+        incremental.update(potentials, threshold)
+        assert_same_surface(incremental, potentials, threshold)
+
+
+def test_dirty_region():
+    incremental = IncrementalSurface(packed_lut)
+    potentials = np.maximum(blob(32, (0.6, 0.6, 0.6)), blob(32, (0.15, 0.15, 0.15), 0.1).clip(-0.03))
+    incremental.update(potentials, 0)
+    # move the small sphere within a region, the mesh of the large one is kept as it is
+    moved = np.maximum(blob(32, (0.6, 0.6, 0.6)), blob(32, (0.2, 0.15, 0.15), 0.1).clip(-0.03))
+    dirty = (slice(0, 14),) * 3
+    outside = moved != potentials
+    outside[dirty] = False
+    assert not np.any(outside)  # all changes are in the dirty region
+    incremental.update(moved, 0, dirty=dirty)
+    assert_same_surface(incremental, moved, 0)
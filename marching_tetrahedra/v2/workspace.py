@@ -0,0 +1,143 @@
+import numpy as np
+
+from isosurface2 import cube_vertices
+
+
+class Workspace:
+    """
+    Marching tetrahedra of a time series of potentials over the same grid, without per-frame allocations.
+    Every scratch array is allocated once for the grid shape, indexed as [y, x, z], and each frame is written into
+    them with out= operations. The outputs are views into persistent buffers, grown when a frame needs more room:
+    they are only valid until the next call to extract.
+    """
+
+    def __init__(self, shape, packed_lut, dtype=np.float32):
+        edges, faces, vertex_counts, face_counts = packed_lut
+        self.shape, self.dtype = tuple(shape), np.dtype(dtype).type
+        self.edges = np.ascontiguousarray(edges, dtype=np.intp).reshape((-1, 2))  # row = configuration * 20 + slot
+        self.faces = np.ascontiguousarray(faces, dtype=np.uint32).reshape(-1)  # row = configuration * 36 + slot
+        self.vertex_slots, self.face_slots = edges.shape[1], faces.shape[1]
+        self.vertex_counts, self.face_counts = np.asarray(vertex_counts, np.intp), np.asarray(face_counts, np.intp)
+
+        ys, xs, zs = self.shape
+        cells_shape = (ys - 1, xs - 1, zs - 1)
+        self.outside = np.empty(self.shape, dtype=bool)
+        self.lut_indexes, self.bits = np.empty(cells_shape, dtype=np.uint8), np.empty(cells_shape, dtype=np.uint8)
+        self.is_active = np.empty(cells_shape, dtype=bool)
+        self.cells = np.arange(np.prod(cells_shape), dtype=np.intp)
+        # linear index into the potentials of the first corner of each cube, and the offsets to the others
+        self.cube_bases = np.ravel_multi_index(np.indices(cells_shape).reshape((3, -1)), self.shape)
+        self.corner_offsets = cube_vertices @ np.array([xs * zs, zs, 1])
+        self.buffers, self.range = {}, np.zeros(0, dtype=np.intp)
+
+    def buffer(self, name, size, dtype, columns=()):
+        """
+        Returns the first size rows of a persistent buffer, growing it by doubling if it is too small, or
+        allocating it again if its dtype changed, e.g. for potentials of another dtype.
+        """
+        buffer = self.buffers.get(name)
+        if buffer is not None and buffer.dtype != dtype:
+            buffer = None
+        if buffer is None or len(buffer) < size:
+            buffer = self.buffers[name] = np.empty((max(size, 2 * len(buffer) if buffer is not None else 1024),)
+                                                   + columns, dtype=dtype)
+        return buffer[:size]
+
+    def expand(self, counts, displacements, name):
+        """
+        For counts rows per item, starting at displacements, writes the item and the slot within it of each row into
+        persistent buffers, like np.repeat would, and returns both. Every count must be positive.
+        """
+        total = int(displacements[-1] + counts[-1]) if len(counts) else 0
+        owner = self.buffer(f'{name} owner', total, np.intp)
+        owner.fill(0)
+        np.put(owner, displacements[1:], 1, mode='clip')
+        np.cumsum(owner, out=owner)
+        slot = self.buffer(f'{name} slot', total, np.intp)
+        np.take(displacements, owner, out=slot, mode='clip')
+        if len(self.range) < total:
+            self.range = np.arange(max(total, 2 * len(self.range)), dtype=np.intp)
+        np.subtract(self.range[:total], slot, out=slot)
+        return owner, slot
+
+    def rows(self, configurations, owner, slot, slots, name):
+        """
+        Returns the row into the flattened lookup table of each slot of each owner, configuration * slots + slot.
+        """
+        owner_configurations = np.take(configurations, owner,
+                                       out=self.buffer(f'{name} configurations', len(owner), np.uint8), mode='clip')
+        rows = self.buffer(f'{name} rows', len(owner), np.intp)
+        np.multiply(owner_configurations, slots, out=rows, dtype=np.intp)
+        np.add(rows, slot, out=rows)
+        return rows
+
+    def extract(self, potentials, threshold, origin=(0, 0, 0), interval=1):
+        """
+        Same as isosurface2.extract, unwelded, mapped to world coordinates like isosurface2.grid_to_world.
+        Returns views of the float32 (V, 3) vertices and uint32 flattened triangles.
+        """
+        ys, xs, zs = self.shape
+
+        # inside/outside state of each cube, like lookup_indexes
+        np.greater(potentials, threshold, out=self.outside)
+        self.lut_indexes.fill(0)
+        for index, (yd, xd, zd) in enumerate(cube_vertices):
+            np.left_shift(self.outside[yd:ys - 1 + yd, xd:xs - 1 + xd, zd:zs - 1 + zd].view(np.uint8), index,
+                          out=self.bits)
+            np.bitwise_or(self.lut_indexes, self.bits, out=self.lut_indexes)
+        np.subtract(self.lut_indexes, 1, out=self.bits)  # wraps around: only 1 to 254 end up below 254
+        np.less(self.bits, 254, out=self.is_active)
+
+        # active cubes, and one row per output vertex: its cube, and the pair of corners it interpolates
+        # np.compress still makes a temporary list of the active cells, far smaller than the other arrays
+        active_count = np.count_nonzero(self.is_active)
+        cells = np.compress(self.is_active.reshape(-1), self.cells, out=self.buffer('cells', active_count, np.intp))
+        cubes = np.take(self.cube_bases, cells, out=self.buffer('cubes', active_count, np.intp), mode='clip')
+        configurations = np.take(self.lut_indexes.reshape(-1), cells,
+                                 out=self.buffer('configurations', active_count, np.uint8), mode='clip')
+
+        counts = np.take(self.vertex_counts, configurations, out=self.buffer('counts', active_count, np.intp),
+                         mode='clip')
+        displacements = np.cumsum(counts, out=self.buffer('displacements', active_count, np.intp))
+        np.subtract(displacements, counts, out=displacements)
+        owner, slot = self.expand(counts, displacements, 'vertex')
+        rows = self.rows(configurations, owner, slot, self.vertex_slots, 'vertex')
+
+        corners, values = [], []
+        for end in (0, 1):
+            corner = self.buffer(f'corner {end}', len(rows), np.intp)
+            np.take(self.edges[:, end], rows, out=corner, mode='clip')
+            np.take(self.corner_offsets, corner, out=corner, mode='clip')
+            np.add(corner, np.take(cubes, owner, out=slot, mode='clip'), out=corner)  # linear index into potentials
+            corners.append(corner)
+            values.append(np.take(potentials.reshape(-1), corner,
+                                  out=self.buffer(f'value {end}', len(rows), potentials.dtype), mode='clip'))
+
+        # ts = (threshold - value_j) / (value_i - value_j), and vertices interpolated one axis at a time
+        ts, scratch = self.buffer('ts', len(rows), self.dtype), self.buffer('scratch', len(rows), self.dtype)
+        np.subtract(self.dtype(threshold), values[1], out=ts, dtype=self.dtype)  # integer scans would wrap around
+        np.subtract(values[0], values[1], out=scratch, dtype=self.dtype)
+        np.divide(ts, scratch, out=ts)
+        verts = self.buffer('verts', len(rows), np.float32, (3,))
+        for stride, size, column in zip((xs * zs, zs, 1), (ys, xs, zs), (1, 0, 2)):
+            coordinate_i, coordinate_j = self.buffer('coordinate i', len(rows), np.intp), slot
+            np.floor_divide(corners[0], stride, out=coordinate_i)
+            np.remainder(coordinate_i, size, out=coordinate_i)
+            np.floor_divide(corners[1], stride, out=coordinate_j)
+            np.remainder(coordinate_j, size, out=coordinate_j)
+            np.subtract(coordinate_i, coordinate_j, out=coordinate_i)
+            np.multiply(ts, coordinate_i, out=scratch)
+            np.add(scratch, coordinate_j, out=scratch)
+            np.multiply(scratch, self.dtype(interval), out=scratch)
+            np.add(scratch, self.dtype(origin[column]), out=verts[:, column])
+
+        # offset each cube's face template by the index of its first vertex
+        counts = np.take(self.face_counts, configurations, out=self.buffer('face counts', active_count, np.intp),
+                         mode='clip')
+        face_displacements = np.cumsum(counts, out=self.buffer('face displacements', active_count, np.intp))
+        np.subtract(face_displacements, counts, out=face_displacements)
+        owner, slot = self.expand(counts, face_displacements, 'face')
+        rows = self.rows(configurations, owner, slot, self.face_slots, 'face')
+        tris = np.take(self.faces, rows, out=self.buffer('tris', len(rows), np.uint32), mode='clip')
+        np.add(tris, np.take(displacements, owner, out=slot, mode='clip'), out=tris, casting='unsafe')
+        return verts, tris
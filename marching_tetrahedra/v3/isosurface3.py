@@ -1,6 +1,8 @@
 import itertools
 import numpy as np
 
+cube_vertices = np.array(list(itertools.product([0, 1], repeat=3)))[[0, 2, 6, 4, 5, 7, 3, 1]]  # gray-like ordering
+
 
 def surface_from_tetra(cube_indexes, outside):
     """
@@ -65,68 +67,167 @@ def precompute_surface_from_cube():
     return face_lut
 
 
-def render(volume, interval, threshold, face_lut):
+def pack_face_lut(face_lut):
+    """
+    Pack the face lookup table into padded arrays, so that all active cubes can be processed at once.
+    Returns (edges, faces, vertex_counts, face_counts) where, for each configuration c:
+      edges[c, :vertex_counts[c]] are the vertices given as a pair of cube indexes
+      faces[c, :face_counts[c]] are the flattened triangles, as indexes into edges[c]
+    """
+    vertex_counts = np.array([len(vertices) for vertices, _ in face_lut], dtype=np.int64)
+    face_counts = np.array([len(faces) for _, faces in face_lut], dtype=np.int64)
 
-    # optimization: do it in slices
+    edges = np.zeros((256, vertex_counts.max(), 2), dtype=np.uint8)
+    faces = np.zeros((256, face_counts.max()), dtype=np.uint32)
+    for configuration, (v_template, f_template) in enumerate(face_lut):
+        edges[configuration, :vertex_counts[configuration]] = np.reshape(v_template, (-1, 2))
+        faces[configuration, :face_counts[configuration]] = f_template
 
-    vertices = np.array(list(itertools.product([0, 1], repeat=3)))
-    vertices = vertices[[0, 2, 6, 4, 5, 7, 3, 1]]  # gray-like ordering
-    x_range, y_range, z_range = [np.arange(volume[dim][0], volume[dim][1] + interval, interval) for dim in range(3)]
-    xx, yy = np.meshgrid(x_range, y_range)
+    return edges, faces, vertex_counts, face_counts
 
-    xs, ys = xx.shape
-    z0 = z_range[0]
-    p0 = sample_fun(xx, yy, z0)
-    o0 = p0 > threshold
-    lut_indexes = np.zeros(np.array(o0.shape) - 1, dtype=int)
-    for z1 in z_range[1:]:  # one slice at a time
-        p1 = sample_fun(xx, yy, z1)
-        o1 = p1 > threshold
 
-        lut_indexes[:] = 0
-        samples_slice = np.stack((o0, o1), axis=-1)
-        for index, (xd, yd, zd) in enumerate(vertices):
-            lut_indexes += 2 ** index * samples_slice[xd:xs - 1 + xd, yd:ys - 1 + yd, zd:zs - 1 + zd]
+def lookup_indexes(potentials, threshold):
+    """
+    Returns the index into the lookup table of each cube, i.e. the inside/outside state of its corners.
+    """
+    xs, ys, zs = potentials.shape
+    outside = potentials > threshold
+    lut_indexes = np.zeros([d - 1 for d in outside.shape], dtype=np.uint8)  # 8 corners, 8 bits
+    for index, (xd, yd, zd) in enumerate(cube_vertices):
+        lut_indexes |= outside[xd:xs - 1 + xd, yd:ys - 1 + yd, zd:zs - 1 + zd].view(np.uint8) << index
+    return lut_indexes
 
-        ...
 
-        z0, p0, o0 = z1, p1, o1
+def edge_keys(corner_i, corner_j, shape):
+    """
+    Returns an integer identifying the grid edge between corners i and j, the same for (i, j) and (j, i).
+    The key is the linear index of the lowest corner, times 27, plus the direction towards the other one.
+    """
+    strides = np.array([shape[1] * shape[2], shape[2], 1])
+    lin_i, lin_j = corner_i @ strides, corner_j @ strides
+    start = np.where((lin_i < lin_j)[:, None], corner_i, corner_j)
+    direction = (corner_i + corner_j - 2 * start + 1) @ np.array([9, 3, 1])
+    return np.minimum(lin_i, lin_j) * 27 + direction
+
+
+def extract_slab(potentials, threshold, packed_lut, z_offset, shape):
+    """
+    Welded marching tetrahedra over a slab of potentials, indexed as [y, x, z].
+    Returns vertices in the grid index space of the whole volume, their global edge keys, and the
+    flattened triangles indexing them.
+    """
+    edges, faces, vertex_counts, face_counts = packed_lut
 
-    xx, yy, zz = np.meshgrid(x_range, y_range, z_range)
-    potentials = sample_fun(xx, yy, zz)
+    lut_indexes = lookup_indexes(potentials, threshold)
+    cubes = np.stack(np.nonzero(np.logical_and(0 < lut_indexes, lut_indexes < 255)), axis=-1)
+    configurations = lut_indexes[tuple(cubes.T)]
 
-    vertices = np.array(list(itertools.product([0, 1], repeat=3)))
-    vertices = vertices[[0, 2, 6, 4, 5, 7, 3, 1]]  # gray-like ordering
+    counts = vertex_counts[configurations]
+    displacements = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(cubes)), counts)
+    pairs = edges[configurations[owner], np.arange(len(owner)) - displacements[owner]]
+    corner_i = cubes[owner] + cube_vertices[pairs[:, 0]]
+    corner_j = cubes[owner] + cube_vertices[pairs[:, 1]]
+    offset = np.array((0, 0, z_offset))
+    keys, unique, welded = np.unique(edge_keys(corner_i + offset, corner_j + offset, shape),
+                                     return_index=True, return_inverse=True)
+    corner_i, corner_j = corner_i[unique], corner_j[unique]
 
-    xs, ys, zs = potentials.shape
-    outside = potentials > threshold
-    lut_indexes = np.zeros([d - 1 for d in outside.shape], dtype=int)
-    for index, (xd, yd, zd) in enumerate(vertices):
-        lut_indexes += 2 ** index * outside[xd:xs - 1 + xd, yd:ys - 1 + yd, zd:zs - 1 + zd]
+    value_i, value_j = potentials[tuple(corner_i.T)], potentials[tuple(corner_j.T)]
+    ts = (threshold - value_j) / (value_i - value_j)
+    verts = offset + corner_j + ts[:, None] * (corner_i - corner_j)
 
-    vertices *= interval
-    valid = 0 < lut_indexes < 255
-    lut_indexes = lut_indexes[valid]
-    origins = np.stack([xx[valid], yy[valid], zz[valid]], axis=-1)
-    coords = origins.reshape() + vertices.reshape()
-    values = ...
+    counts = face_counts[configurations]
+    owner = np.repeat(np.arange(len(cubes)), counts)
+    tris = faces[configurations[owner], np.arange(len(owner)) - (np.cumsum(counts) - counts)[owner]]
+    tris = welded[tris + displacements[owner]]
 
-    verts, tris = [], []
-    for lut_index, coord_list, value_list in zip(lut_indexes, coords, values):
-        displacement = len(verts)
-        v_template, f_template = face_lut[lut_index]
-        for i, j in v_template:
-            t = (threshold - value_list[j]) / (value_list[i] - value_list[j])
-            verts.append(t * coord_list[i] + (1 - t) * coord_list[j])
-        tris.extend(f_template + displacement)
+    return verts, keys, tris
 
-    return verts, tris
+
+def render_slices(slices, shape, origin, interval, threshold, face_lut):
+    """
+    Streaming marching tetrahedra: consumes an iterable of z-slices of potentials, each indexed as [y, x], and yields
+    a mesh chunk for each slab between consecutive slices. Only two slices of samples are kept in memory, together
+    with the ids of the vertices lying on the last one, that are shared with the next slab.
+    Each chunk is (verts, tris): the float32 vertices first seen in this slab, to be appended to those of the previous
+    chunks, and uint32 flattened triangles indexing into the whole mesh.
+    shape is the (y, x, z) number of samples, and origin the (x, y, z) coordinates of the first one.
+    Takes the output of pack_face_lut.
+    """
+    vertex_count = 0
+    shared_keys, shared_ids = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    slices = iter(slices)
+    p0 = next(slices)
+    for k, p1 in enumerate(slices):  # one slab at a time
+        verts, keys, tris = extract_slab(np.stack((p0, p1), axis=-1), threshold, face_lut, k, shape)
+
+        # vertices on the first slice of the slab were already emitted by the previous one
+        is_shared = np.isin(keys, shared_keys)
+        ids = np.empty(len(keys), dtype=np.int64)
+        ids[is_shared] = shared_ids[np.searchsorted(shared_keys, keys[is_shared])]
+        ids[~is_shared] = vertex_count + np.arange(len(keys) - np.count_nonzero(is_shared))
+        vertex_count += len(keys) - np.count_nonzero(is_shared)
+
+        # edges lying on the last slice (lowest corner there, no z direction) are shared with the next slab
+        on_last_slice = (keys // 27 % shape[2] == k + 1) & (keys % 3 == 1)
+        shared_keys, shared_ids = keys[on_last_slice], ids[on_last_slice]
+
+        new_verts = origin + interval * verts[~is_shared][:, [1, 0, 2]]
+        yield new_verts.astype(np.float32), ids[tris].astype(np.uint32)
+        p0 = p1
+
+
+def render(volume, interval, sample_fun, threshold, face_lut):
+    """
+    Streaming marching tetrahedra of sample_fun over the volume, sampled one z-slice at a time.
+    See render_slices for the chunks yielded.
+    """
+    x_range, y_range, z_range = [np.arange(volume[dim][0], volume[dim][1] + interval, interval) for dim in range(3)]
+    xx, yy = np.meshgrid(x_range, y_range)
+    shape = (len(y_range), len(x_range), len(z_range))
+    origin = np.array((x_range[0], y_range[0], z_range[0]))
+    slices = (sample_fun(xx, yy, np.full_like(xx, z)) for z in z_range)
+    return render_slices(slices, shape, origin, interval, threshold, face_lut)
+
+
+def load_volume(filename, shape=None, dtype=None, offset=0):
+    """
+    Memory-map a pre-sampled volume from disk, without reading it. .npy files carry their shape and dtype,
+    raw files need both, and may start after a header of offset bytes.
+    Volumes are indexed as [z, y, x], so that each z-slice is contiguous on disk.
+    """
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def render_samples(samples, origin, interval, threshold, face_lut):
+    """
+    Streaming marching tetrahedra of a pre-sampled volume indexed as [z, y, x], of any dtype, e.g. as returned
+    by load_volume. Slices are read from disk, and converted to float32, one at a time.
+    origin is the (x, y, z) coordinates of samples[0, 0, 0]. See render_slices for the chunks yielded.
+    """
+    zs, ys, xs = samples.shape
+    slices = (np.asarray(samples[z], dtype=np.float32) for z in range(zs))
+    return render_slices(slices, (ys, xs, zs), np.asarray(origin), interval, threshold, face_lut)
 
 
 if __name__ == '__main__':
-    face_lut = precompute_surface_from_cube()
-    print(f'{face_lut=}')
+    import sys
+    from mesh_io import write_mesh
+
+    def sample_fun(xx, yy, zz):
+
+        def gaussian_3d(mu, gamma):
+            xmmu = np.linalg.norm(np.stack([xx, yy, zz], axis=-1) - mu, axis=-1)  # x minus mu
+            return np.exp(-xmmu ** 2 / (2 * gamma ** 2)) / gamma * np.sqrt(2 * np.pi)
 
-    render(((-1, 1),) * 3, 0.05, 6, face_lut)
+        return gaussian_3d([-0.5, 0, 0], 0.4) + gaussian_3d([-0.2, 0.7, 0], 0.2) + gaussian_3d([0.5, 0, 0], 0.3)
 
-    pass
+    face_lut = pack_face_lut(precompute_surface_from_cube())
+    if len(sys.argv) > 1:  # stream the chunks straight to a .ply, .glb or .obj file
+        write_mesh(sys.argv[1], render(((-1, 1),) * 3, 0.05, sample_fun, 6, face_lut))
+    chunks = list(render(((-1, 1),) * 3, 0.05, sample_fun, 6, face_lut))
+    verts, tris = np.concatenate([verts for verts, _ in chunks]), np.concatenate([tris for _, tris in chunks])
+    print(f'{len(chunks)} slabs, {len(verts)} vertices, {len(tris) // 3} triangles')
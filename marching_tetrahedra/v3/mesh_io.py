@@ -0,0 +1,118 @@
+import json
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+
+def as_chunks(mesh):
+    """
+    Accepts either a single (verts, tris) mesh, as returned by render, or an iterable of such chunks, as yielded
+    by the streaming renderers, and yields float32 (n, 3) vertices and uint32 (m, 3) triangles for each.
+    Triangles of every chunk index into the vertices of the whole mesh.
+    """
+    if isinstance(mesh, tuple):  # a whole mesh, chunks come in a list or a generator
+        mesh = [mesh]
+    for verts, tris in mesh:
+        yield np.asarray(verts, dtype=np.float32).reshape(-1, 3), np.asarray(tris, dtype=np.uint32).reshape(-1, 3)
+
+
+def spool(chunks):
+    """
+    Write the vertices and triangles of the chunks to two temporary files as raw little-endian buffers, so that
+    the mesh never needs to be held in memory. Returns both files, rewound, with the vertex and triangle counts,
+    and the min and max of the vertices.
+    """
+    verts_file, tris_file = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+    vertex_count, triangle_count = 0, 0
+    lower, upper = np.full(3, np.inf, dtype=np.float32), np.full(3, -np.inf, dtype=np.float32)
+    for verts, tris in as_chunks(chunks):
+        verts_file.write(verts.astype('<f4').tobytes())
+        tris_file.write(tris.astype('<u4').tobytes())
+        vertex_count, triangle_count = vertex_count + len(verts), triangle_count + len(tris)
+        if len(verts):
+            lower, upper = np.minimum(lower, verts.min(axis=0)), np.maximum(upper, verts.max(axis=0))
+    verts_file.seek(0)
+    tris_file.seek(0)
+    return verts_file, tris_file, vertex_count, triangle_count, lower, upper
+
+
+def write_ply(filename, chunks, chunk_faces=1 << 16):
+    """
+    Write a binary little-endian PLY file. Vertices and triangles are spooled to disk first, since the header
+    needs their counts, then copied behind it, chunk_faces triangles at a time.
+    """
+    verts_file, tris_file, vertex_count, triangle_count, _, _ = spool(chunks)
+    face = np.dtype([('count', 'u1'), ('indexes', '<u4', 3)])
+    with verts_file, tris_file, open(filename, 'wb') as file:
+        file.write(('ply\n'
+                    'format binary_little_endian 1.0\n'
+                    f'element vertex {vertex_count}\n'
+                    'property float x\n'
+                    'property float y\n'
+                    'property float z\n'
+                    f'element face {triangle_count}\n'
+                    'property list uchar uint vertex_indices\n'
+                    'end_header\n').encode('ascii'))
+        shutil.copyfileobj(verts_file, file)
+        while tris := tris_file.read(chunk_faces * 12):
+            faces = np.empty(len(tris) // 12, dtype=face)
+            faces['count'], faces['indexes'] = 3, np.frombuffer(tris, dtype='<u4').reshape(-1, 3)
+            file.write(faces.tobytes())
+
+
+def write_glb(filename, chunks):
+    """
+    Write a binary glTF 2.0 (.glb) file holding a single indexed triangle mesh. Vertices and triangles are spooled
+    to disk first, since the JSON chunk needs their counts and bounds, then copied into the binary chunk.
+    """
+    verts_file, tris_file, vertex_count, triangle_count, lower, upper = spool(chunks)
+    verts_size, tris_size = vertex_count * 12, triangle_count * 12
+    gltf = {
+        'asset': {'version': '2.0'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0}, 'indices': 1, 'mode': 4}]}],
+        'buffers': [{'byteLength': verts_size + tris_size}],
+        'bufferViews': [{'buffer': 0, 'byteOffset': 0, 'byteLength': verts_size, 'target': 34962},
+                        {'buffer': 0, 'byteOffset': verts_size, 'byteLength': tris_size, 'target': 34963}],
+        'accessors': [{'bufferView': 0, 'componentType': 5126, 'count': vertex_count, 'type': 'VEC3',
+                       'min': lower.tolist(), 'max': upper.tolist()},
+                      {'bufferView': 1, 'componentType': 5125, 'count': triangle_count * 3, 'type': 'SCALAR'}],
+    }
+    if vertex_count == 0:
+        del gltf['accessors'][0]['min'], gltf['accessors'][0]['max']
+    content = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    content += b' ' * (-len(content) % 4)  # chunks are 4-byte aligned, vertex and index data already are
+    total_size = 12 + 8 + len(content) + 8 + verts_size + tris_size
+    with verts_file, tris_file, open(filename, 'wb') as file:
+        file.write(struct.pack('<4sII', b'glTF', 2, total_size))
+        file.write(struct.pack('<I4s', len(content), b'JSON') + content)
+        file.write(struct.pack('<I4s', verts_size + tris_size, b'BIN\0'))
+        shutil.copyfileobj(verts_file, file)
+        shutil.copyfileobj(tris_file, file)
+
+
+def write_obj(filename, chunks):
+    """
+    Write a text Wavefront OBJ file. Triangles only reference vertices of their own or earlier chunks,
+    so each chunk is written as soon as it is produced, without spooling.
+    """
+    with open(filename, 'w') as file:
+        for verts, tris in as_chunks(chunks):
+            np.savetxt(file, verts, fmt='v %.7g %.7g %.7g')
+            np.savetxt(file, tris.astype(np.int64) + 1, fmt='f %d %d %d')  # OBJ indexes from 1
+
+
+writers = {'.ply': write_ply, '.glb': write_glb, '.obj': write_obj}
+
+
+def write_mesh(filename, chunks):
+    """
+    Write a mesh, or a stream of mesh chunks, in the format given by the extension of filename: .ply, .glb or .obj.
+    """
+    extension = filename[filename.rfind('.'):].lower()
+    if extension not in writers:
+        raise ValueError(f'Unsupported mesh format {extension!r}, expected one of {", ".join(writers)}')
+    writers[extension](filename, chunks)